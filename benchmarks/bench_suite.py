@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import matplotlib
+import numpy as np
+
+sys.path.insert(0, ".")
+matplotlib.use("agg")  # Use non-GUI backend
+
+import matplotlib.pyplot as plt
+
+from covid_sim.animation import Animation, plot_simulation
+from covid_sim.defaults import defaults
+from covid_sim.simulator import MeasureSchedule, Simulation, get_measures, parse_parameters
+
+"""
+Benchmark suite for the hot paths of the simulation and its drawing code.
+Times each benchmark at several grid sizes, taking the best of a few repeats, and measures its peak memory (allocated
+through Python and numpy, from a separate run with tracemalloc, so tracing doesn't slow the timed runs).
+The results are saved as JSON. Given a baseline saved earlier, any benchmark that got slower by more than the
+threshold is flagged, and the script exits with status 1 so it can be used to catch regressions.
+
+Usage: python benchmarks/bench_suite.py [--sizes 50 200 1000 4000] [--days 20] [--output results.json]
+                                        [--baseline baseline.json] [--threshold 1.2] [--only update ...]
+"""
+
+SIZES = (50, 200, 1000, 4000)
+SEED = 2021
+
+
+def get_simulation(size, days=0):
+    # Seeded simulation with an epidemic under way (more initial cases on larger grids), run for days
+    kwargs = parse_parameters({**defaults, "size": size, "seed": SEED, "duration": days})
+    simulation = Simulation(**kwargs)
+    simulation.infect_randomly(max(defaults["cases"], size * size // 500))
+    for day in range(days):
+        simulation.update()
+    return simulation
+
+
+# Each benchmark takes the grid size and number of days, does any setup and returns a function to time along with
+# the number of days it covers (None if the time isn't per day)
+
+def bench_init(size, days):
+    kwargs = parse_parameters({**defaults, "size": size, "seed": SEED})
+    return lambda: Simulation(**kwargs).close(), None
+
+
+def bench_update(size, days):
+    simulation = get_simulation(size)
+
+    def run():
+        for day in range(days):
+            simulation.update()
+    return run, days
+
+
+def bench_vaccinate(size, days):
+    # Every call vaccinates people in the same grid, so the number of calls is kept well within the number of eligible
+    # people (on small grids they would otherwise run out, and most calls would time the fallback for when few are left)
+    simulation = get_simulation(size, days)
+    vaccinator = simulation.vaccinator
+    vaccinator.vaccination_capacity = vaccinator.vaccination_max_capacity
+    status = simulation.get_status_grid()
+    eligible = np.count_nonzero(vaccinator.is_eligible(status))
+    calls = max(1, min(1000, eligible // int(vaccinator.vaccination_max_capacity) // 2))
+
+    def run():
+        for call in range(calls):
+            vaccinator.vaccinate(status)
+    return run, calls
+
+
+def bench_measures(size, days):
+    # Measures start and stop through a schedule, looked up every day (building it included)
+    measures = parse_parameters(defaults)["measures"]
+
+    def run():
+        schedule = MeasureSchedule(get_measures(measures))
+        for day in range(days):
+            schedule.multipliers(day)
+    return run, days
+
+
+def bench_count_status(size, days):
+    simulation = get_simulation(size, days)
+    return simulation.get_count_status, None
+
+
+def bench_rgb_matrix(size, days):
+    simulation = get_simulation(size, days)
+    return simulation.get_rgb_matrix, None
+
+
+def bench_plot_simulation(size, days):
+    simulation = get_simulation(size)
+
+    def run():
+        plt.close(plot_simulation(simulation, days))
+    return run, days
+
+
+def bench_animation_save(size, days):
+    filename = os.path.join(tempfile.gettempdir(), "bench_animation.gif")
+    animation = Animation(get_simulation(size), days)
+
+    def run():
+        animation.save(filename)
+        plt.close(animation.figure)
+    return run, days
+
+
+BENCHMARKS = {
+    "init": bench_init,
+    "update": bench_update,
+    "vaccinate": bench_vaccinate,
+    "measures": bench_measures,
+    "count_status": bench_count_status,
+    "rgb_matrix": bench_rgb_matrix,
+    "plot_simulation": bench_plot_simulation,
+    "animation_save": bench_animation_save,
+}
+
+# Benchmarks which draw with matplotlib run for fewer days, as they are much slower per day
+DRAWING = ("plot_simulation", "animation_save")
+
+
+def measure(benchmark, size, days, repeats):
+    """Best time of repeats runs (per call for benchmarks not covering days), and peak memory of one more run under
+    tracemalloc"""
+    times = []
+    for repeat in range(repeats):
+        run, per_days = benchmark(size, days)  # Fresh setup for every run, as runs change the simulation
+        if per_days:
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        else:
+            # Quick calls are timed over enough calls to take a fraction of a second
+            number, seconds = timeit.Timer(run).autorange()
+            times.append(seconds / number)
+
+    run, per_days = benchmark(size, days)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {"seconds": min(times), "peak_memory": peak}
+    if per_days:
+        result["seconds_per_day"] = min(times) / per_days
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Prints how each benchmark compares with the baseline, returning the slowdowns beyond the threshold"""
+    slowdowns = []
+    for name, sizes in results["results"].items():
+        for size, result in sizes.items():
+            previous = baseline["results"].get(name, {}).get(size)
+            if previous is None:
+                continue
+            ratio = result["seconds"] / previous["seconds"]
+            flag = "SLOWER" if ratio > threshold else ""
+            print(f"{name:>16} {size:>5}: {previous['seconds']:.4g}s -> {result['seconds']:.4g}s ({ratio:.2f}x) {flag}")
+            if flag:
+                slowdowns.append((name, size, ratio))
+    return slowdowns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the simulation's hot paths at several grid sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--days", type=int, default=20, help="days to run each benchmark that covers several days")
+    parser.add_argument("--drawing-days", type=int, default=5, help="days for plot_simulation and animation_save")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results saved earlier to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="time ratio over the baseline to flag")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                 "days": args.days, "drawing_days": args.drawing_days, "repeats": args.repeats},
+        "results": {},
+    }
+    for name in args.only or BENCHMARKS:
+        days = args.drawing_days if name in DRAWING else args.days
+        for size in args.sizes:
+            result = measure(BENCHMARKS[name], size, days, args.repeats)
+            results["results"].setdefault(name, {})[str(size)] = result
+            per_day = f", {1000 * result['seconds_per_day']:.3f} ms/day" if "seconds_per_day" in result else ""
+            print(f"{name:>16} {size:>5}: {result['seconds']:.4g}s{per_day}, "
+                  f"peak {result['peak_memory'] / 2 ** 20:.1f} MB")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slowdowns = compare(results, baseline, args.threshold)
+        if slowdowns:
+            print(f"{len(slowdowns)} benchmark(s) slower than the baseline by more than {args.threshold}x")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
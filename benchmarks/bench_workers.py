@@ -0,0 +1,45 @@
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, ".")
+
+from covid_sim.defaults import defaults
+from covid_sim.simulator import Simulation, parse_parameters
+
+"""
+Scaling benchmark for the multi-core tiled engine.
+Runs the same seeded simulation with 1, 2, 4 and 8 workers, printing the time per day and the speed up over one worker,
+and checks that every worker count produced exactly the same grid.
+
+Usage: python benchmarks/bench_workers.py [size] [days]
+"""
+
+
+def get_kwargs(size, workers):
+    return parse_parameters({**defaults, "size": size, "workers": workers, "seed": 2021})
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    results = {}
+    for workers in (1, 2, 4, 8):
+        simulation = Simulation(**get_kwargs(size, workers))
+        simulation.infect_randomly(size)
+        start = time.perf_counter()
+        for day in range(days):
+            simulation.update()
+        per_day = (time.perf_counter() - start) / days
+        results[workers] = (per_day, simulation.get_status_grid())
+        simulation.close()
+
+        speed_up = results[1][0] / per_day
+        identical = np.array_equal(results[1][1], results[workers][1])
+        print(f"workers={workers}: {1000 * per_day:.1f} ms/day, speed up {speed_up:.2f}x, identical={identical}")
+
+
+if __name__ == "__main__":
+    main()
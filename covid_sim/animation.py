@@ -10,7 +10,7 @@ class Animation:
 
     """
 
-    def __init__(self, simulation, duration):
+    def __init__(self, simulation, duration, downsample=1):
         """Sets out the framework for the animation to take place in"""
         self.simulation = simulation
         self.duration = duration
@@ -19,18 +19,18 @@ class Animation:
         self.axes_grid = self.figure.add_subplot(1, 2, 1)
         self.axes_line = self.figure.add_subplot(1, 2, 2)
 
-        self.gridanimation = GridAnimation(self.axes_grid, self.simulation)
+        self.gridanimation = GridAnimation(self.axes_grid, self.simulation, downsample)
         self.lineanimation = LineAnimation(self.axes_line, self.simulation, duration)
 
     def show(self):
         """Runs the animation on screen"""
-        animation = FuncAnimation(self.figure, self.update, frames=range(100),
+        animation = FuncAnimation(self.figure, self.update, frames=range(self.duration),
                                   init_func=self.init, blit=True, interval=200)
         plt.show()
 
     def save(self, filename):
-        """Run the animation and save as a video"""
-        animation = FuncAnimation(self.figure, self.update, frames=range(100),
+        """Run the animation and save as a video (see export.py for a faster way to save without matplotlib)"""
+        animation = FuncAnimation(self.figure, self.update, frames=range(self.duration),
                                   init_func=self.init, blit=True, interval=300)
         writergif = PillowWriter(fps=10)
         animation.save(filename, writer=writergif)
@@ -45,19 +45,27 @@ class Animation:
     def update(self, framenumber):
         """Continously updates the animation frame by frame """
         self.simulation.update()
+        profiler = self.simulation.profiler  # Times drawing each frame, if the simulation is being profiled
+        if profiler is not None:
+            profiler.mark()
         actors = []
         actors += self.gridanimation.update(framenumber)
+        if profiler is not None:
+            profiler.lap("grid animation")
         actors += self.lineanimation.update(framenumber)
+        if profiler is not None:
+            profiler.lap("line animation")
         return actors
 
 
 class GridAnimation:
     """Animates the grid showing people's status (infected, dead, etc...) at each position"""
 
-    def __init__(self, axes, simulation):
+    def __init__(self, axes, simulation, downsample=1):
         self.axes = axes
         self.simulation = simulation
-        rgb_matrix = self.simulation.get_rgb_matrix()
+        self.downsample = downsample  # Shrink large grids by this factor (most common status in each block)
+        rgb_matrix = self.simulation.get_rgb_matrix(self.downsample)
         """Assigns people status' to colours for visual purposes"""
         self.image = self.axes.imshow(rgb_matrix)
         self.axes.set_xticks([])
@@ -69,7 +77,7 @@ class GridAnimation:
     def update(self, framenum):
         """(frame number indicates number of days)"""
         day = framenum
-        rgb_matrix = self.simulation.get_rgb_matrix()
+        rgb_matrix = self.simulation.get_rgb_matrix(self.downsample)
         self.image.set_array(rgb_matrix)
         return [self.image]
 
@@ -82,8 +90,6 @@ class LineAnimation:
         self.axes = axes
         self.simulation = simulation
         self.duration = duration
-        self.xdata = []
-        self.ydata = {status: [] for status in simulation.STATUSES}
         self.line_mpl = {}
         for status, colour in simulation.COLOURMAP.items():
             [line] = self.axes.plot([], [], color=colour, label=status, linewidth=2)
@@ -99,18 +105,16 @@ class LineAnimation:
         return []
 
     def update(self, framenum):
-        """Converting counts into percentages"""
-        counts = self.simulation.get_count_status()
+        """Converting counts into percentages (read straight from the simulation's count history)"""
+        history = self.simulation.get_count_history()
         total = self.simulation.width * self.simulation.height
-        percents = {k: 100 * v / total for k, v in counts.items()}
-        self.xdata.append(len(self.xdata))
-        for status, percent in percents.items():
-            self.ydata[status].append(percent)
-            self.line_mpl[status].set_data(self.xdata, self.ydata[status])
+        days = np.arange(len(history))
+        for status, statusnum in self.simulation.STATUSES.items():
+            self.line_mpl[status].set_data(days, 100 * history[:, statusnum] / total)
         return list(self.line_mpl.values())
 
 
-def plot_simulation(simulation, duration):
+def plot_simulation(simulation, duration, downsample=1):
     """Produces a grid plot showing status' at different points in time.
 
     At the end of the animation, a 5x3 grid of subplots showing the status at 15 different days (frames)
@@ -125,17 +129,23 @@ def plot_simulation(simulation, duration):
     """Fixes the sapcing between subplots"""
     fig.subplots_adjust(wspace=0.1, hspace=0.4)
 
-    """Finding days that are approximately equally spaced"""
-    days = [(duration * i) // (N - 1) for i in range(N)]
+    """Finding days that are approximately equally spaced (from the day the simulation or replay is on)"""
+    start = simulation.day
+    days = [start + (duration * i) // (N - 1) for i in range(N)]
 
+    profiler = simulation.profiler  # Times drawing each subplot, if the simulation is being profiled
     for ax, day in zip(axes, days):
         while simulation.day < day:
             simulation.update()
-        rgb_matrix = simulation.get_rgb_matrix()
+        if profiler is not None:
+            profiler.mark()
+        rgb_matrix = simulation.get_rgb_matrix(downsample)
         ax.imshow(rgb_matrix)
         ax.set_title('Day ' + str(day))
         ax.set_xticks([])
         ax.set_yticks([])
+        if profiler is not None:
+            profiler.lap("plotting")
 
     """ Return the figure generated by animation.py. The user of this 
     program can then decide whether to either show (screen) or savefig (file)."""
@@ -144,7 +154,7 @@ def plot_simulation(simulation, duration):
 
 def plot_ages(simulation):
     """Produces a histogram of the age distribution in the simulation"""
-    age_grid = simulation.age_grid
+    age_grid = simulation.get_age_grid()
 
     n_bins = 100
     fig, axs = plt.subplots(1, 1)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from covid_sim.defaults import defaults
+from covid_sim.simulator import Simulation, parse_parameters
+
+"""
+Cli.py runs a simulation from the command line, without the web app, for scripted and server-side runs:
+
+    python -m covid_sim.cli config.json --seed 1 --counts counts.csv --animation run.gif --plot plot.png
+
+The configuration file (JSON, or YAML if PyYAML is installed) has the same shape as the defaults dictionary; any values
+it leaves out keep their defaults. Only the modules needed for the chosen outputs are imported (matplotlib only for
+the plots, using its non-GUI backend), and the wall time and peak memory of the run are reported when it finishes.
+"""
+
+
+def load_config(path):
+    """Reads a configuration file (YAML if the file name ends in .yaml or .yml, otherwise JSON)"""
+    with open(path) as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("Reading a YAML configuration needs PyYAML (pip install pyyaml)")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def merge_config(base, config):
+    """
+    Lays the configuration over the base (defaults) dictionary. Sections are merged, so a configuration only needs the
+    values it changes, but an age band table (e.g. the Infection probabilities) is replaced as a whole.
+    """
+    merged = dict(base)
+    for key, value in config.items():
+        if isinstance(value, dict):
+            value = {int(k) if isinstance(k, str) and k.isdigit() else k: v for k, v in value.items()}
+            if isinstance(merged.get(key), dict) and not all(isinstance(k, int) for k in value):
+                value = merge_config(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def peak_memory():
+    """Peak resident memory of this process in bytes, or None where it can't be measured"""
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, kilobytes elsewhere
+
+
+def save_counts(path, simulation, counts):
+    # Writes the count of each status on every day as csv, json or npy (from the file extension)
+    names = list(simulation.STATUSES)
+    if path.lower().endswith(".npy"):
+        np.save(path, counts)
+    elif path.lower().endswith(".json"):
+        with open(path, "w") as f:
+            json.dump({name: counts[:, simulation.STATUSES[name]].tolist() for name in names}, f)
+    else:
+        days = np.arange(len(counts))[:, None]
+        np.savetxt(path, np.hstack([days, counts]), fmt="%d", delimiter=",", header=",".join(["day", *names]),
+                   comments="")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="python -m covid_sim.cli",
+                                     description="Runs a simulation without the web app")
+    parser.add_argument("config", nargs="?", help="JSON or YAML file shaped like the defaults (default: the defaults)")
+    parser.add_argument("--seed", type=int, help="seed for a reproducible run")
+    parser.add_argument("--workers", type=int, help="number of processes for the tiled engine")
+    parser.add_argument("--engine", choices=["grid", "cell", "frontier", "packed", "network"], help="update engine")
+    parser.add_argument("--duration", type=int, help="number of days to run (overrides the configuration)")
+    parser.add_argument("--counts", help="save the counts of each status per day (.csv, .json or .npy)")
+    parser.add_argument("--trajectory", help="stream the whole trajectory to this folder (see trajectory.py)")
+    parser.add_argument("--animation", help="save an animation (.gif, .apng or .raw)")
+    parser.add_argument("--plot", help="save the plot of the grid over time (an image file, e.g. .png)")
+    parser.add_argument("--ages", help="save the histogram of ages (an image file, e.g. .png)")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    start = time.perf_counter()
+
+    config = merge_config(defaults, load_config(args.config) if args.config else {})
+    for option in ("seed", "workers", "engine", "duration", "trajectory"):
+        if getattr(args, option) is not None:
+            config[option] = getattr(args, option)
+    duration = config["duration"]
+
+    simulation = Simulation(**parse_parameters(config))
+    simulation.infect_randomly(config["cases"])
+    try:
+        if args.animation or args.plot:
+            # Record the run once, so the animation and the plot show the same run
+            from covid_sim.recorder import History
+            history = History.record(simulation, duration)
+            counts = history.get_count_history()
+        else:
+            for day in range(duration):
+                simulation.update()
+            counts = simulation.get_count_history()
+    finally:
+        simulation.close()
+    simulated = time.perf_counter() - start
+
+    if args.counts:
+        save_counts(args.counts, simulation, counts)
+    if args.animation:
+        from covid_sim.export import export_animation
+        export_animation(history.replay(), duration, args.animation)
+    if args.plot or args.ages:
+        import matplotlib
+        matplotlib.use("agg")  # Use non-GUI backend
+        from covid_sim.animation import plot_simulation, plot_ages
+        if args.plot:
+            plot_simulation(history.replay(), duration).savefig(args.plot)
+        if args.ages:
+            plot_ages(simulation).savefig(args.ages)
+
+    total = time.perf_counter() - start
+    print(f"Simulated {duration} days of a {simulation.width}x{simulation.height} grid in {simulated:.2f}s "
+          f"({1000 * simulated / max(duration, 1):.2f}ms per day), {total:.2f}s in total")
+    print("Final counts: " + ", ".join(f"{status} {int(counts[-1, code])}"
+                                       for status, code in simulation.STATUSES.items()))
+    memory = peak_memory()
+    if memory is not None:
+        print(f"Peak memory: {memory / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import numpy as np
+
+from covid_sim.kernels import SUSCEPTIBLE, INFECTED, RECOVERED, VACCINATED
+from covid_sim.kernels import count_infected_neighbours, apply_transitions
+from covid_sim.simulator import Simulation, Vaccinator, MeasureSchedule, get_measures, random_ages, probability_table
+from covid_sim.simulator import as_seed_sequence, parse_parameters
+
+"""
+Ensemble.py is used to run many replicates of the same scenario at once.
+A single Simulation run is only one random sample of how the epidemic could go, so for planning we run many replicates
+and look at the median and percentile bands of the status counts.
+Rather than building one Simulation per replicate, the replicates are stacked along a leading axis of the arrays and all
+advanced together with the same whole-grid kernels the Simulation uses.
+Each replicate draws from its own random stream spawned from the ensemble's seed, so a replicate's result doesn't depend
+on which batch it was run in.
+"""
+
+
+class Ensemble:
+    """
+    The Ensemble class runs a number of replicates of a scenario, given parameters in the shape of the defaults
+    dictionary (like a Sweep and the command line runner) or already converted to a Simulation's keyword arguments.
+    Replicates are advanced in batches (of batch_size, by default all of them at once) to bound the memory used.
+    """
+
+    STATUSES = Simulation.STATUSES
+
+    def __init__(self, params, replicates=200, batch_size=None, seed=None):
+        self.params = parse_parameters(params)
+        self.replicates = replicates
+        self.batch_size = batch_size or replicates
+        self.seed_sequence = as_seed_sequence(seed if seed is not None else params.get("seed"))
+        self.replicate_seeds = self.seed_sequence.spawn(replicates)
+        self.counts = None
+
+    def run(self, duration):
+        """
+        Runs every replicate for duration days, returning the counts of each status with shape
+        (replicates, duration + 1, 5) - day 0 (after the initial cases) up to and including the final day
+        """
+        self.counts = np.zeros((self.replicates, duration + 1, len(self.STATUSES)), dtype=np.int64)
+        for start in range(0, self.replicates, self.batch_size):
+            stop = min(start + self.batch_size, self.replicates)
+            rngs = [np.random.default_rng(seed) for seed in self.replicate_seeds[start:stop]]
+            self.run_batch(self.counts[start:stop], duration, rngs)
+        return self.counts
+
+    def run_batch(self, counts, duration, rngs):
+        # Runs len(counts) replicates together, filling in counts, with one random stream per replicate
+        replicates = len(counts)
+        size = self.params["size"]
+        length = self.params["length"]
+        probabilities = self.params["probabilities"]
+        shape = (replicates, size, size)
+
+        status_buffers = np.full((2, *shape), SUSCEPTIBLE, dtype=np.uint8)
+        front = 0
+        neighbours = np.zeros(shape, dtype=np.uint8)
+        draws = np.zeros(shape, dtype=np.float32)
+        ages = np.stack([random_ages((size, size), rng) for rng in rngs])
+        infection_probability = probability_table(probabilities["Infection"])[ages]
+        recovery_probability = (probability_table(probabilities["Recovery"]) / length)[ages]
+        death_probability = (probability_table(probabilities["Death"]) / length)[ages]
+
+        # Infect the initial cases in every replicate
+        cases = self.params["cases"]
+        for replicate, rng in enumerate(rngs):
+            i, j = rng.integers(size, size=(2, cases))
+            status_buffers[front][replicate, i, j] = INFECTED
+
+        vaccinator = Vaccinator(**self.params["vaccinator"])
+        schedule = MeasureSchedule(get_measures(self.params["measures"]))
+
+        counts[:, 0] = self.count(status_buffers[front])
+        for day in range(duration):
+            status = status_buffers[front]
+            if vaccinator.start_time <= day:
+                self.vaccinate(vaccinator, status, rngs)
+            count_infected_neighbours(status, out=neighbours)
+            for replicate, rng in enumerate(rngs):
+                rng.random(dtype=np.float32, out=draws[replicate])
+            apply_transitions(status, neighbours, draws, infection_probability, recovery_probability,
+                              death_probability, out=status_buffers[1 - front],
+                              multipliers=schedule.multipliers(day))
+            front = 1 - front
+            counts[:, day + 1] = self.count(status_buffers[front])
+
+    @staticmethod
+    def vaccinate(vaccinator, status, rngs):
+        # Vaccinates up to the vaccination capacity of eligible people in every replicate, without replacement, by
+        # giving everyone a random key (ineligible people can never be picked) and taking the smallest keys
+        vaccinator.increase_capacity()
+        capacity = int(vaccinator.vaccination_capacity)
+        if capacity == 0:
+            return
+        flat = status.reshape(len(status), -1)
+        capacity = min(capacity, flat.shape[1])
+        keys = np.stack([rng.random(flat.shape[1]) for rng in rngs])
+        keys[(flat != SUSCEPTIBLE) & (flat != RECOVERED)] = 2
+        chosen = np.argpartition(keys, capacity - 1, axis=1)[:, :capacity]
+        rows = np.arange(len(flat))[:, None]
+        eligible = keys[rows, chosen] < 2
+        flat[np.broadcast_to(rows, chosen.shape)[eligible], chosen[eligible]] = VACCINATED
+
+    def count(self, status):
+        # Counts of each status in each replicate in one pass, shape (replicates, 5)
+        n = len(self.STATUSES)
+        offsets = (np.arange(len(status)) * n).reshape(-1, 1, 1)
+        return np.bincount((status + offsets).ravel(), minlength=len(status) * n).reshape(len(status), n)
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """
+        Returns the quantiles of the counts across the replicates for each status, as a dictionary of
+        status -> array of shape (len(quantiles), duration + 1)
+        """
+        bands = np.quantile(self.counts, quantiles, axis=0)
+        return {status: bands[:, :, code] for status, code in self.STATUSES.items()}
@@ -0,0 +1,186 @@
+import struct
+import zlib
+
+import numpy as np
+
+from covid_sim.kernels import N_STATUSES
+from covid_sim.render import Renderer, simulation_colours
+from covid_sim.simulator import MAX_AGE
+
+"""
+Export.py is used to save an animation of the simulation straight from the status and age grids, without drawing a
+matplotlib figure for every frame.
+Frames are produced and written one at a time as the simulation runs, so they are never all held in memory. The number
+of frames follows the duration (day 0 up to and including the last day).
+
+GIF and APNG files are written as indexed (palette) images: each status gets AGE_SHADES shades of its colour, darker for
+older ages like the rgb matrix, so a frame is just a lookup of the status and age grids with no colour quantisation.
+A raw stream is plain rgb24 frames one after the other (e.g. for piping into ffmpeg with -f rawvideo -pix_fmt rgb24).
+An optional line chart of the percentage of people in each status can be drawn under the grid.
+"""
+
+AGE_SHADES = 50  # Shades per status in the indexed palette (every 2 years of age)
+BACKGROUND = N_STATUSES * AGE_SHADES  # Palette index of the chart background
+AXIS = BACKGROUND + 1  # Palette index of the chart axis
+
+
+def indexed_palette(colours):
+    # 256 colour palette: AGE_SHADES shades of each status colour, then the chart background and axis colours
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    ages = np.arange(0, MAX_AGE, MAX_AGE // AGE_SHADES).reshape(-1, 1)
+    for code, colour_rgb in colours.items():
+        colour_rgb = np.array(colour_rgb).reshape(1, -1)
+        palette[code * AGE_SHADES:(code + 1) * AGE_SHADES] = np.where(colour_rgb != 0,
+                                                                      np.clip(colour_rgb - ages, 0, 255), 0)
+    palette[BACKGROUND] = (255, 255, 255)
+    palette[AXIS] = (128, 128, 128)
+    return palette
+
+
+class FrameSource:
+    """
+    The FrameSource class steps a simulation and produces one indexed frame (grid plus optional chart) per day.
+    """
+
+    def __init__(self, simulation, duration, overlay=True, downsample=1, scale=1):
+        self.simulation = simulation
+        self.duration = duration
+        self.age = simulation.get_age_grid()  # Ages don't change, and the packed engine has to unpack them
+        self.downsample = downsample
+        self.scale = scale  # Each cell is drawn as scale x scale pixels
+        self.colours = simulation_colours(simulation)
+        self.palette = indexed_palette(self.colours)
+        # Palette index of every (status, age) pair
+        self.lookup = (np.arange(N_STATUSES).reshape(-1, 1) * AGE_SHADES
+                       + np.arange(MAX_AGE) // (MAX_AGE // AGE_SHADES)).astype(np.uint8)
+
+        status, age = self.grids()
+        self.grid_shape = status.shape
+        self.chart = None
+        if overlay:
+            height = max(self.grid_shape[0] // 3, 20)
+            self.chart = np.full((height, self.grid_shape[1]), BACKGROUND, dtype=np.uint8)
+            self.chart[0] = AXIS
+        self.frame = np.zeros((self.grid_shape[0] + (0 if self.chart is None else len(self.chart)),
+                               self.grid_shape[1]), dtype=np.uint8)
+
+    @property
+    def shape(self):
+        # (rows, columns) of the frames produced
+        return self.frame.shape[0] * self.scale, self.frame.shape[1] * self.scale
+
+    def grids(self):
+        # Status and age grids, downsampled to the most common status in each block if needed
+        if self.downsample == 1:
+            return self.simulation.status, self.age
+        return Renderer.downsample(self.simulation.status, self.age, self.downsample)
+
+    def draw_chart(self, frame):
+        # Adds the line from the previous day to this day for each status to the chart. The count history is indexed
+        # from its end, as it may not start at day 0 (e.g. a replay of a history recorded part way through a run)
+        history = self.simulation.get_count_history()
+        height, width = self.chart.shape
+        total = self.simulation.width * self.simulation.height
+        x = frame * (width - 1) // max(self.duration, 1)
+        x_previous = (frame - 1) * (width - 1) // max(self.duration, 1) if frame > 0 else x
+        previous = -2 if frame > 0 and len(history) > 1 else -1
+        for code in self.colours:
+            y = (height - 1) - history[-1, code] * (height - 2) // total
+            y_previous = (height - 1) - history[previous, code] * (height - 2) // total
+            top, bottom = sorted((y, y_previous))
+            self.chart[top:bottom + 1, x_previous:x + 1] = code * AGE_SHADES
+
+    def frames(self):
+        """Yields the indexed frame for each day, advancing the simulation between frames"""
+        for day in range(self.duration + 1):
+            if day > 0:
+                self.simulation.update()
+            status, age = self.grids()
+            np.take(self.lookup.reshape(-1), status.astype(np.intp) * MAX_AGE + age,
+                    out=self.frame[:self.grid_shape[0]])
+            if self.chart is not None:
+                self.draw_chart(day)
+                self.frame[self.grid_shape[0]:] = self.chart
+            if self.scale == 1:
+                yield self.frame
+            else:
+                yield self.frame.repeat(self.scale, axis=0).repeat(self.scale, axis=1)
+
+
+def write_gif(f, source, fps):
+    # Streams the frames into a looping GIF using Pillow's GIF encoder one frame at a time
+    from PIL import Image, GifImagePlugin
+
+    palette = source.palette.tobytes()
+    duration = int(1000 / fps)
+    for n, frame in enumerate(source.frames()):
+        image = Image.frombuffer("L", (frame.shape[1], frame.shape[0]), frame.tobytes(), "raw", "L", 0, 1)
+        image = image.convert("P")
+        image.putpalette(palette)
+        if n == 0:
+            header, _ = GifImagePlugin.getheader(image, palette, {"loop": 0, "optimize": False, "duration": duration})
+            for chunk in header:
+                f.write(chunk)
+        for chunk in GifImagePlugin.getdata(image, duration=duration, disposal=1):
+            f.write(chunk)
+    f.write(b";")
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def write_apng(f, source, fps):
+    # Streams the frames into an indexed colour animated PNG
+    height, width = source.shape
+    n_frames = source.duration + 1
+    f.write(b"\x89PNG\r\n\x1a\n")
+    f.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)))
+    f.write(png_chunk(b"acTL", struct.pack(">II", n_frames, 0)))
+    f.write(png_chunk(b"PLTE", source.palette.tobytes()))
+    sequence = 0
+    for n, frame in enumerate(source.frames()):
+        f.write(png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, 1, fps, 0, 0)))
+        sequence += 1
+        # Each row of the image data starts with its filter type (0 - none)
+        rows = np.zeros((height, width + 1), dtype=np.uint8)
+        rows[:, 1:] = frame
+        data = zlib.compress(rows.tobytes(), 6)
+        if n == 0:
+            f.write(png_chunk(b"IDAT", data))
+        else:
+            f.write(png_chunk(b"fdAT", struct.pack(">I", sequence) + data))
+            sequence += 1
+    f.write(png_chunk(b"IEND", b""))
+
+
+def write_raw(f, source, fps):
+    # Streams the frames as raw rgb24
+    for frame in source.frames():
+        f.write(source.palette[frame].tobytes())
+
+
+WRITERS = {
+    "gif": write_gif,
+    "apng": write_apng,
+    "png": write_apng,
+    "raw": write_raw,
+    "rgb": write_raw,
+}
+
+
+def export_animation(simulation, duration, filename, format=None, fps=10, overlay=True, downsample=1, scale=1):
+    """
+    Runs the simulation for duration days and writes the animation to filename (a path or a binary file object).
+    The format is taken from the file extension if it isn't given: gif, apng/png or raw/rgb.
+    """
+    if format is None:
+        format = str(getattr(filename, "name", filename)).rsplit(".", 1)[-1].lower()
+    if format not in WRITERS:
+        raise ValueError(f"Unknown animation format: {format}")
+    source = FrameSource(simulation, duration, overlay, downsample, scale)
+    if hasattr(filename, "write"):
+        WRITERS[format](filename, source, fps)
+    else:
+        with open(filename, "wb") as f:
+            WRITERS[format](f, source, fps)
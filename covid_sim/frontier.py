@@ -0,0 +1,60 @@
+import numpy as np
+
+from covid_sim.kernels import INFECTED, SUSCEPTIBLE, NEIGHBOUR_OFFSETS, apply_transitions
+
+"""
+Frontier.py is used to advance the simulation by only visiting the people whose status can actually change.
+On any day the only people that can change status are those who are infected (they may recover or die) and the
+susceptible people next to them (they may be infected). Early and late in an epidemic this is a small band of people, so
+keeping an index of the infected people and working out their susceptible neighbours from it makes the cost of a day
+scale with the size of the outbreak rather than the area of the grid.
+"""
+
+
+class Frontier:
+    """
+    The Frontier class keeps an index (flat positions in the grid) of everyone who is currently infected.
+    The index is updated incrementally every day from the transitions that happen, so the full grid is never scanned
+    after it has been built.
+    """
+
+    def __init__(self, status):
+        self.height, self.width = status.shape
+        self.infected = np.flatnonzero(status == INFECTED)
+
+    def add_infected(self, cells):
+        # Adds newly infected people (flat positions) which were infected outside of step, e.g. by infect_randomly
+        self.infected = np.union1d(self.infected, cells)
+
+    def susceptible_neighbours(self, status):
+        # Returns the susceptible people next to an infected person and how many infected neighbours each has
+        rows, cols = np.divmod(self.infected, self.width)
+        neighbours = []
+        for di, dj in NEIGHBOUR_OFFSETS:
+            r, c = rows + di, cols + dj
+            inside = (r >= 0) & (r < self.height) & (c >= 0) & (c < self.width)  # Clip at the edges of the grid
+            neighbours.append(r[inside] * self.width + c[inside])
+        neighbours = np.concatenate(neighbours)
+        neighbours = neighbours[status[neighbours] == SUSCEPTIBLE]
+        return np.unique(neighbours, return_counts=True)
+
+    def step(self, status, infection_probability, recovery_probability, death_probability, multipliers, rng,
+             changes=None):
+        """
+        Advances the grid by one day, in place, only visiting the frontier.
+        Everything is gathered from today's state before anything is written back, so each person's new status is
+        still a function of the previous day only.
+        """
+        status = status.reshape(-1)
+        candidates, counts = self.susceptible_neighbours(status)
+        cells = np.concatenate([self.infected, candidates])
+        neighbours = np.concatenate([np.zeros(len(self.infected), dtype=counts.dtype), counts])
+
+        new_status = apply_transitions(status[cells], neighbours, rng.random(len(cells), dtype=np.float32),
+                                       infection_probability.reshape(-1)[cells],
+                                       recovery_probability.reshape(-1)[cells],
+                                       death_probability.reshape(-1)[cells], multipliers=multipliers,
+                                       changes=changes)
+        status[cells] = new_status
+        self.infected = cells[new_status == INFECTED]
+        return cells, new_status
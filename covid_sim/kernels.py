@@ -0,0 +1,90 @@
+import numpy as np
+
+"""
+Kernels.py holds the whole-grid array operations used to advance the simulation by one day.
+Rather than visiting each person in turn, these work on the full status grid at once with numpy, so the cost per day is
+a handful of array passes regardless of the grid size.
+All of the functions work on the last two axes of the arrays given, so a stack of grids (e.g. several replicates or a
+tile of a larger grid) can be passed in just as well as a single grid.
+"""
+
+SUSCEPTIBLE = 0
+INFECTED = 1
+RECOVERED = 2
+DEAD = 3
+VACCINATED = 4
+N_STATUSES = 5
+
+# Offsets of the eight (Moore) neighbours around a person
+NEIGHBOUR_OFFSETS = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di, dj) != (0, 0)]
+
+
+def shifted_slices(n, offset):
+    # Returns the (destination, source) slices along one axis of length n so that destination[k] is the neighbour at
+    # k + offset, clipped to the edges of the grid (people on the edge simply have fewer neighbours)
+    if offset < 0:
+        return slice(-offset, n), slice(0, n + offset)
+    elif offset > 0:
+        return slice(0, n - offset), slice(offset, n)
+    return slice(0, n), slice(0, n)
+
+
+def count_infected_neighbours(status, out=None):
+    """Counts the number of infected neighbours around every person with one shifted sum per neighbour offset"""
+    infected = (status == INFECTED).view(np.uint8)
+    if out is None:
+        out = np.zeros(status.shape, dtype=np.uint8)
+    else:
+        out[...] = 0
+    height, width = status.shape[-2:]
+    for di, dj in NEIGHBOUR_OFFSETS:
+        dst_i, src_i = shifted_slices(height, di)
+        dst_j, src_j = shifted_slices(width, dj)
+        out[..., dst_i, dst_j] += infected[..., src_i, src_j]
+    return out
+
+
+def apply_transitions(status, neighbours, draws, infection_probability, recovery_probability, death_probability,
+                      out=None, multipliers=(1.0, 1.0, 1.0), changes=None):
+    """
+    Computes the next day's status of every person from today's status, writing it into out (which may be status).
+    The (infection, recovery, death) multipliers of any measures in force are applied to the probabilities here.
+    If changes (an array with one element per status) is given, the change in the number of people with each status is
+    added to it.
+
+    A single uniform draw per person is used for all of the tests. An infected person recovers if draw < recovery
+    probability, otherwise the draw is uniform over the remaining interval and they die if it falls within the first
+    death probability fraction of it - the same as the per-person second draw of the cell by cell update.
+    """
+    infection_multiplier, recovery_multiplier, death_multiplier = multipliers
+    if infection_multiplier != 1:
+        infection_probability = infection_probability * np.float32(infection_multiplier)
+    if recovery_multiplier != 1:
+        recovery_probability = recovery_probability * np.float32(recovery_multiplier)
+    if death_multiplier != 1:
+        death_probability = death_probability * np.float32(death_multiplier)
+
+    infected = status == INFECTED
+    recovers = infected & (draws < recovery_probability)
+    dies = infected & ~recovers & (draws < recovery_probability + death_probability * (1 - recovery_probability))
+    infects = (status == SUSCEPTIBLE) & (draws < neighbours * infection_probability)
+    if out is None:
+        out = status.copy()
+    elif out is not status:
+        np.copyto(out, status)
+    out[recovers] = RECOVERED
+    out[dies] = DEAD
+    out[infects] = INFECTED
+
+    if changes is not None:
+        n_recovers, n_dies, n_infects = np.count_nonzero(recovers), np.count_nonzero(dies), np.count_nonzero(infects)
+        changes[SUSCEPTIBLE] -= n_infects
+        changes[INFECTED] += n_infects - n_recovers - n_dies
+        changes[RECOVERED] += n_recovers
+        changes[DEAD] += n_dies
+    return out
+
+
+def count_statuses(status):
+    """Number of people with each status, in one pass over the grid"""
+    return np.bincount(status.ravel(), minlength=N_STATUSES)
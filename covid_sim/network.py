@@ -0,0 +1,122 @@
+import numpy as np
+
+from covid_sim.kernels import NEIGHBOUR_OFFSETS
+
+"""
+Network.py is used to simulate contacts given by a network (graph) rather than only the eight neighbours on the grid,
+e.g. households, workplaces and long-range contacts.
+Contacts are stored as a sparse adjacency matrix in CSR form: the contacts of person i are
+indices[indptr[i]:indptr[i+1]], with an optional weight for each contact (how much exposure it gives, 1 if there are no
+weights). A person's infection pressure for the day is the (weighted) number of their contacts who are infected, which
+for everyone at once is the adjacency matrix multiplied by the infected indicator, one pass over the contacts.
+People are numbered by their flat position in the grid, which is only used to draw them. The grid itself is the network
+of each person's eight neighbours (see ContactNetwork.lattice), which gives exactly the same results as the grid engine.
+"""
+
+
+def index_dtype(n):
+    # Smallest integer type for indices up to n, to keep tens of millions of contacts small
+    return np.int32 if n < 2 ** 31 else np.int64
+
+
+class ContactNetwork:
+    """
+    The ContactNetwork class holds the contacts of n people as CSR arrays (indptr, indices and optionally weights).
+    Contacts are directed, from the person who could be infected to the people who could infect them, so an undirected
+    contact is listed under both people (from_edges does this by default).
+    """
+
+    def __init__(self, indptr, indices, weights=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=index_dtype(len(self.indptr)))
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float32)
+        if self.indptr[-1] != len(self.indices) or \
+                (self.weights is not None and len(self.weights) != len(self.indices)):
+            raise ValueError("indptr, indices and weights don't describe the same number of contacts")
+        # Only people with contacts start a sum, so people without any don't break np.add.reduceat
+        self.has_contacts = np.flatnonzero(np.diff(self.indptr))
+        self.starts = self.indptr[self.has_contacts]
+
+    @property
+    def n_nodes(self):
+        return len(self.indptr) - 1
+
+    @property
+    def n_contacts(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, n, sources, targets, weights=None, symmetric=True):
+        """
+        Builds the network of n people from a list of contacts between sources[k] and targets[k] (with weights[k]),
+        listing each contact under both people if symmetric.
+        """
+        sources, targets = np.asarray(sources, dtype=index_dtype(n)), np.asarray(targets, dtype=index_dtype(n))
+        if symmetric:
+            sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+            if weights is not None:
+                weights = np.concatenate([weights, weights])
+        order = np.argsort(sources)  # Group the contacts by person (in any order within a person)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return cls(indptr, targets[order], None if weights is None else np.asarray(weights)[order])
+
+    @classmethod
+    def lattice(cls, width, height):
+        """The grid's network: everyone's contacts are their (up to) eight neighbours"""
+        n = width * height
+        rows, cols = np.divmod(np.arange(n, dtype=index_dtype(n)), height)
+        neighbours = np.empty((n, len(NEIGHBOUR_OFFSETS)), dtype=index_dtype(n))
+        valid = np.empty(neighbours.shape, dtype=bool)
+        # The offsets are in order of flat position, so each person's contacts come out sorted
+        for k, (di, dj) in enumerate(NEIGHBOUR_OFFSETS):
+            valid[:, k] = (rows + di >= 0) & (rows + di < width) & (cols + dj >= 0) & (cols + dj < height)
+            neighbours[:, k] = np.arange(n) + di * height + dj
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=indptr[1:])
+        return cls(indptr, neighbours[valid])
+
+    def pressure(self, infected):
+        """
+        Infection pressure on everyone (float32): the weighted number of their contacts who are infected, given a flat
+        boolean array of who is infected. This is the product of the adjacency matrix and the infected indicator.
+        """
+        values = infected.view(np.uint8)[self.indices]
+        if self.weights is not None:
+            values = values * self.weights
+        pressure = np.zeros(self.n_nodes, dtype=np.float32)
+        if len(values):
+            pressure[self.has_contacts] = np.add.reduceat(values, self.starts, dtype=np.float32)
+        return pressure
+
+
+def group_edges(groups):
+    """
+    Contacts between everyone in the same group (e.g. a household or workplace), given each person's group number
+    (-1 for no group). Returns (sources, targets) with each pair listed once, for ContactNetwork.from_edges.
+    """
+    groups = np.asarray(groups)
+    people = np.flatnonzero(groups >= 0).astype(index_dtype(len(groups)))
+    people = people[np.argsort(groups[people], kind="stable")]
+    sorted_groups = groups[people]
+    # Pair each person with everyone after them in their group, one gap at a time
+    sources, targets = [], []
+    gap = 1
+    while gap < len(people):
+        same = sorted_groups[gap:] == sorted_groups[:-gap]
+        if not same.any():
+            break
+        sources.append(people[:-gap][same])
+        targets.append(people[gap:][same])
+        gap += 1
+    if not sources:
+        return np.zeros(0, dtype=people.dtype), np.zeros(0, dtype=people.dtype)
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def random_edges(n, contacts, rng):
+    """contacts random long-range contacts between any two of n people. Returns (sources, targets)"""
+    sources = rng.integers(n, size=contacts)
+    targets = rng.integers(n, size=contacts)
+    distinct = sources != targets
+    return sources[distinct], targets[distinct]
@@ -0,0 +1,177 @@
+import numpy as np
+
+from covid_sim.kernels import N_STATUSES, count_infected_neighbours, apply_transitions
+from covid_sim.simulator import AGE_RANGES, AGE_RANGE_WEIGHTS, MAX_AGE, probability_table
+
+"""
+Packed.py is used to run very large grids in a compact form, half a byte per person for their status plus half a byte
+for their age band, instead of a byte of status (twice, double buffered), a byte of age and three float probabilities.
+Nobody's exact age or probabilities are stored. The probability tables only change at their age band boundaries, so
+everyone in the same band (between two boundaries) has the same probabilities, and a small index into per-band tables
+is enough to look them up.
+Each day is computed a tile of rows at a time: the tile is unpacked (with the row above and below, for neighbours),
+advanced with the same kernels as the grid engine and packed back in place. With the same seed the results are identical
+to the grid engine's.
+"""
+
+# Number of people in a tile, small enough for a tile's unpacked arrays to stay in the cache
+TILE_CELLS = 2 ** 16
+
+
+class PackedGrid:
+    """
+    The PackedGrid class holds a flat array of 4-bit values (0 to 15), two per byte: the value at flat position p is in
+    the low half of byte p // 2 if p is even and the high half if p is odd.
+    Positions can be read and written with an integer array (like a flat numpy array), and ranges unpacked and packed.
+    """
+
+    def __init__(self, size, fill=0):
+        self.size = size
+        self.data = np.full((size + 1) // 2, fill | fill << 4, dtype=np.uint8)
+
+    def reshape(self, shape):
+        # The values are already flat, so reshape(-1) (as used on a status grid by the Vaccinator) is the grid itself
+        if shape != -1:
+            raise ValueError("A PackedGrid can only be reshaped to flat (-1)")
+        return self
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                raise IndexError("Slices of a PackedGrid must be contiguous")
+            return self.unpack(start, stop)
+        positions = np.asarray(key)
+        return ((self.data[positions >> 1] >> ((positions & 1) << 2)) & 0xF).astype(np.uint8)
+
+    def __setitem__(self, positions, values):
+        # Even and odd positions are written separately, so two people sharing a byte never overwrite each other
+        positions = np.asarray(positions).reshape(-1)
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint8), positions.shape)
+        for half in (0, 1):
+            selected = (positions & 1) == half
+            index = positions[selected] >> 1
+            shift = 4 * half
+            self.data[index] = (self.data[index] & (0xF0 >> shift)) | (values[selected] << shift)
+
+    def unpack(self, start, stop):
+        """Values at flat positions start to stop (a new uint8 array)"""
+        first, last = start // 2, (stop + 1) // 2
+        data = self.data[first:last]
+        out = np.empty(2 * len(data), dtype=np.uint8)
+        out[0::2] = data & 0xF
+        out[1::2] = data >> 4
+        return out[start - 2 * first:stop - 2 * first]
+
+    def pack(self, start, values):
+        """Writes values to flat positions starting at start"""
+        stop = start + len(values)
+        if start % 2 and len(values):
+            self[start] = values[0]  # Shares its byte with the value before start
+            start, values = start + 1, values[1:]
+        if stop % 2 and len(values):
+            self[stop - 1] = values[-1]  # Shares its byte with the value after stop
+            stop, values = stop - 1, values[:-1]
+        self.data[start // 2:stop // 2] = values[0::2] | (values[1::2] << 4)
+
+
+def age_band_tables(probabilities, infection_length):
+    """
+    Splits ages into bands at every boundary of the probability tables, returning the band of each age (0 to 99), an
+    age to show for each band (the middle of the band) and the infection, recovery and death probability of each band.
+    """
+    bounds = sorted({int(band) for table in probabilities.values() for band in table if 0 < int(band) < MAX_AGE})
+    lows, highs = np.array([0, *bounds]), np.array([*bounds, MAX_AGE])
+    if len(lows) > 16:
+        raise ValueError(f"The probability tables have {len(lows)} age bands, the packed engine allows at most 16")
+    age_bands = np.searchsorted(bounds, np.arange(MAX_AGE), side="right").astype(np.uint8)
+    band_ages = ((lows + highs - 1) // 2).astype(np.uint8)
+    tables = (probability_table(probabilities["Infection"])[lows],
+              (probability_table(probabilities["Recovery"]) / infection_length)[lows],
+              (probability_table(probabilities["Death"]) / infection_length)[lows])
+    return age_bands, band_ages, tables
+
+
+def random_age_tiles(shape, rng, rows):
+    """
+    Yields (first row, ages) for a tile of rows at a time, giving exactly the ages random_ages(shape, rng) does for the
+    whole grid at once. random_ages draws everyone's age range and then everyone's position within their range, so a
+    second generator is started where the first will have finished drawing ranges (PCG64 can jump ahead).
+    """
+    lows = np.array([ages.start for ages in AGE_RANGES])
+    spans = np.array([len(ages) for ages in AGE_RANGES])
+    second = np.random.Generator(type(rng.bit_generator)())
+    second.bit_generator.state = rng.bit_generator.state
+    second.bit_generator.advance(shape[0] * shape[1])  # One 64 bit step per uniform double drawn for the ranges
+    for first in range(0, shape[0], rows):
+        tile = (min(rows, shape[0] - first), shape[1])
+        bands = rng.choice(len(AGE_RANGES), size=tile, p=AGE_RANGE_WEIGHTS)
+        yield first, (lows[bands] + (second.random(tile) * spans[bands]).astype(int)).astype(np.uint8)
+
+
+class PackedEngine:
+    """
+    The PackedEngine class holds the packed status and age band grids of a simulation and advances them by a day in
+    place, a tile of rows at a time.
+    """
+
+    def __init__(self, shape, probabilities, infection_length, rng):
+        self.shape = shape
+        self.rows = max(1, TILE_CELLS // shape[1])  # Rows per tile
+        self.age_bands, self.band_ages, self.tables = age_band_tables(probabilities, infection_length)
+        self.status = PackedGrid(shape[0] * shape[1])
+        self.bands = PackedGrid(shape[0] * shape[1])
+        for first, ages in random_age_tiles(shape, rng, self.rows):
+            self.bands.pack(first * shape[1], self.age_bands[ages].reshape(-1))
+
+    def tiles(self):
+        # (first, last) rows of each tile
+        for first in range(0, self.shape[0], self.rows):
+            yield first, min(first + self.rows, self.shape[0])
+
+    def unpack_rows(self, grid, first, last):
+        return grid.unpack(first * self.shape[1], last * self.shape[1]).reshape(last - first, self.shape[1])
+
+    def status_grid(self):
+        """Everyone's status (a new uint8 grid)"""
+        return self.unpack_rows(self.status, 0, self.shape[0])
+
+    def ages(self):
+        """Everyone's age, shown as the middle of their age band (a new uint8 grid)"""
+        return self.band_ages[self.unpack_rows(self.bands, 0, self.shape[0])]
+
+    def count_statuses(self):
+        # Number of people with each status, counted a tile at a time
+        counts = np.zeros(N_STATUSES, dtype=np.int64)
+        for first, last in self.tiles():
+            counts += np.bincount(self.unpack_rows(self.status, first, last).reshape(-1), minlength=N_STATUSES)
+        return counts
+
+    def step(self, multipliers, rng, changes=None):
+        """
+        Advances everyone by one day, in place. Each tile is unpacked with the row above it as it was before that row
+        was updated (kept from the previous tile), so everyone's new status only depends on the previous day.
+        The random draws are taken from rng a tile at a time, in the same order as the grid engine takes them all at
+        once.
+        """
+        infection, recovery, death = self.tables
+        width = self.shape[1]
+        above = None  # Last row of the previous tile as it was before it was updated
+        for first, last in self.tiles():
+            top, bottom = max(first - 1, 0), min(last + 1, self.shape[0])
+            tile = self.unpack_rows(self.status, top, bottom)
+            if first > 0:
+                tile[0] = above
+            rows = slice(first - top, last - top)
+            neighbours = count_infected_neighbours(tile)[rows]
+            today = tile[rows]
+            above = today[-1].copy()
+            draws = rng.random((last - first, width), dtype=np.float32)
+            bands = self.unpack_rows(self.bands, first, last)
+            new_status = apply_transitions(today, neighbours, draws, infection[bands], recovery[bands], death[bands],
+                                           multipliers=multipliers, changes=changes)
+            self.status.pack(first * width, new_status.reshape(-1))
+
+    @property
+    def nbytes(self):
+        return self.status.data.nbytes + self.bands.data.nbytes
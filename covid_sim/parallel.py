@@ -0,0 +1,126 @@
+import weakref
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from covid_sim.kernels import N_STATUSES, count_infected_neighbours, apply_transitions
+
+"""
+Parallel.py is used to run the whole-grid transition step across several processes.
+The status buffers and probability grids are moved into shared memory so every worker process can see them without
+copying. The grid is cut into fixed blocks of rows; each day every worker advances its share of the blocks, reading a
+one row halo either side of each block from today's (front) buffer and writing into tomorrow's (back) buffer.
+
+Every block draws its random numbers from its own stream, derived from the simulation's seed, the day and the block
+number.
+The blocks don't depend on the number of workers, so the results are bit-identical whatever the worker count.
+"""
+
+BLOCK_ROWS = 64  # Number of grid rows in each block (and random number stream)
+
+# Arrays attached in each worker process, set up by attach_arrays
+shared_arrays = {}
+
+
+def attach_arrays(layout):
+    # Worker initialiser - attach to the shared memory blocks created by the main process
+    for name, (shm_name, shape, dtype) in layout.items():
+        shm = SharedMemory(name=shm_name)
+        shared_arrays[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def block_generator(seed, day, block):
+    # Independent random stream for one block on one day, a child of the simulation's transition seed
+    return np.random.default_rng(np.random.SeedSequence(seed.entropy, spawn_key=(*seed.spawn_key, day, block)))
+
+
+def advance_blocks(arrays, front, blocks, day, seed, multipliers):
+    """
+    Advances the given row blocks by one day from the front buffer into the back buffer, returning the change in the
+    number of people with each status
+    """
+    changes = np.zeros(N_STATUSES, dtype=np.int64)
+    buffers = arrays["status_buffers"]
+    status, new_status = buffers[front], buffers[1 - front]
+    height = status.shape[0]
+    for block in blocks:
+        start, stop = block * BLOCK_ROWS, min((block + 1) * BLOCK_ROWS, height)
+        # Include a one row halo either side so the neighbour counts on the block's edges are correct, the halo is
+        # then dropped again (at the real edges of the grid there is no halo, which clips exactly as before)
+        halo_start, halo_stop = max(start - 1, 0), min(stop + 1, height)
+        neighbours = count_infected_neighbours(status[halo_start:halo_stop])[start - halo_start:stop - halo_start]
+        rows = slice(start, stop)
+        draws = block_generator(seed, day, block).random(neighbours.shape, dtype=np.float32)
+        apply_transitions(status[rows], neighbours, draws, arrays["infection_probability"][rows],
+                          arrays["recovery_probability"][rows], arrays["death_probability"][rows],
+                          out=new_status[rows], multipliers=multipliers, changes=changes)
+    return changes
+
+
+def advance_blocks_in_worker(front, blocks, day, seed, multipliers):
+    arrays = {name: array for name, (shm, array) in shared_arrays.items()}
+    return advance_blocks(arrays, front, blocks, day, seed, multipliers)
+
+
+def release(pool, shms):
+    if pool is not None:
+        pool.terminate()
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
+class TiledEngine:
+    """
+    The TiledEngine class moves a simulation's grids into shared memory and advances them with a pool of workers.
+    With one worker the blocks are advanced in the main process (no pool is started) using the same random streams.
+    """
+
+    SHARED = ("status_buffers", "infection_probability", "recovery_probability", "death_probability")
+
+    def __init__(self, simulation, workers, seed):
+        self.workers = workers
+        self.seed = seed
+        self.n_blocks = -(-simulation.width // BLOCK_ROWS)
+        # Split the blocks into one contiguous chunk per worker
+        self.chunks = [chunk.tolist() for chunk in np.array_split(np.arange(self.n_blocks), workers) if len(chunk)]
+
+        self.shms = []
+        layout = {}
+        self.arrays = {}
+        for name in self.SHARED:
+            array = getattr(simulation, name)
+            shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared[...] = array
+            setattr(simulation, name, shared)  # The simulation now reads and writes the shared copy
+            self.shms.append(shm)
+            self.arrays[name] = shared
+            layout[name] = (shm.name, array.shape, array.dtype)
+
+        self.pool = None
+        if workers > 1:
+            self.pool = Pool(workers, initializer=attach_arrays, initargs=(layout,))
+        self.finalizer = weakref.finalize(self, release, self.pool, self.shms)
+
+    def step(self, front, day, multipliers):
+        # Advance every block by one day (the caller then swaps the buffers), returning the change in each status count
+        if self.pool is None:
+            return advance_blocks(self.arrays, front, range(self.n_blocks), day, self.seed, multipliers)
+        return sum(self.pool.starmap(advance_blocks_in_worker,
+                                     [(front, chunk, day, self.seed, multipliers) for chunk in self.chunks]))
+
+    def close(self, simulation):
+        """
+        Shuts down the workers and frees the shared memory. The simulation's grids are first copied back into private
+        arrays, so it can still be read (or carried on, a block at a time in this process) once the memory is gone.
+        """
+        if not self.finalizer.alive:
+            return
+        for name in self.SHARED:
+            private = getattr(simulation, name).copy()
+            setattr(simulation, name, private)
+            self.arrays[name] = private
+        self.finalizer()
+        self.pool = None
@@ -0,0 +1,74 @@
+import json
+import time
+
+"""
+Profiling.py records where the time goes in a simulation, phase by phase and day by day.
+A Simulation created with profile=True gets a Profiler, which its update (and the animation code drawing it) reports
+each phase's time to, along with how many people were visited and how many changed status. Without it the simulation
+only checks that it has no profiler, so profiling costs nothing when it is off.
+"""
+
+
+class Profiler:
+    """
+    The Profiler class holds a record for every day: the time taken by each phase (in seconds), the number of people
+    visited by the update and the number of status changes (infections, recoveries, deaths and vaccinations).
+    """
+
+    def __init__(self):
+        self.days = []
+        self.last = time.perf_counter()
+
+    def start(self, day):
+        # Opens the record for a new day and starts timing its first phase
+        self.days.append({"day": day, "phases": {}, "visited": 0, "transitions": 0})
+        self.mark()
+
+    def mark(self):
+        # Starts timing a phase
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        # Adds the time since the last mark (or lap) to phase on the latest day, and starts timing the next phase
+        now = time.perf_counter()
+        if self.days:
+            phases = self.days[-1]["phases"]
+            phases[phase] = phases.get(phase, 0) + now - self.last
+        self.last = now
+
+    def count(self, visited=0, transitions=0):
+        # Adds to the number of people visited and status changes on the latest day
+        self.days[-1]["visited"] += visited
+        self.days[-1]["transitions"] += transitions
+
+    def report(self):
+        """Totals over every recorded day: the total and mean time per day of each phase, people visited and changes"""
+        n_days = max(len(self.days), 1)
+        totals = {}
+        for record in self.days:
+            for phase, seconds in record["phases"].items():
+                totals[phase] = totals.get(phase, 0) + seconds
+        return {
+            "days": len(self.days),
+            "phases": {phase: {"total": total, "per_day": total / n_days} for phase, total in totals.items()},
+            "visited": sum(record["visited"] for record in self.days),
+            "transitions": sum(record["transitions"] for record in self.days),
+        }
+
+    def summary(self):
+        """The report as a table of text"""
+        report = self.report()
+        total = sum(phase["total"] for phase in report["phases"].values()) or 1
+        lines = [f"{'Phase':<16}{'Total (ms)':>12}{'Per day (ms)':>14}{'Share':>8}"]
+        for phase, times in report["phases"].items():
+            lines.append(f"{phase:<16}{1000 * times['total']:>12.2f}{1000 * times['per_day']:>14.3f}"
+                         f"{times['total'] / total:>8.1%}")
+        lines.append(f"{report['days']} days, {report['visited']} people visited, "
+                     f"{report['transitions']} status changes")
+        return "\n".join(lines)
+
+    def save(self, path):
+        """Writes the record of each day as a line of JSON"""
+        with open(path, "w") as f:
+            for record in self.days:
+                f.write(json.dumps(record) + "\n")
@@ -0,0 +1,130 @@
+import numpy as np
+
+from covid_sim.render import Renderer, simulation_colours
+
+"""
+Recorder.py is used to run a simulation once and keep its whole trajectory, so the animation, the plot of the grid over
+time and the line chart can all be drawn from the same run without simulating it again.
+Each day is stored as the list of people whose status changed (their flat positions and new statuses), with a full copy
+of the grid (a keyframe) every few days so any day can be rebuilt quickly.
+"""
+
+
+class History:
+    """
+    The History class holds the recorded trajectory of a simulation: the ages, the status on every day (as keyframes
+    and per-day changes) and the count of each status on every day.
+    """
+
+    def __init__(self, simulation, keyframe_interval=10):
+        # Starts the history from the simulation's current day
+        self.width = simulation.width
+        self.height = simulation.height
+        self.STATUSES = simulation.STATUSES
+        self.COLOURMAP = simulation.COLOURMAP
+        self.COLOURMAP_RGB = simulation.COLOURMAP_RGB
+        self.age = simulation.get_age_grid()
+        self.start_day = simulation.day
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = [simulation.get_status_grid()]
+        self.changes = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8))]
+        self.previous = simulation.get_status_grid()
+        self.counts = [simulation.get_count_history()[-1].copy()]
+
+    @classmethod
+    def record(cls, simulation, duration, keyframe_interval=10):
+        """Runs the simulation for duration days, recording every day"""
+        history = cls(simulation, keyframe_interval)
+        for day in range(duration):
+            simulation.update()
+            history.append(simulation)
+        return history
+
+    def append(self, simulation):
+        # Records the simulation's latest day
+        status = simulation.status
+        changed = np.flatnonzero(status != self.previous)
+        self.changes.append((changed, status.reshape(-1)[changed]))
+        np.copyto(self.previous, status)
+        if self.duration % self.keyframe_interval == 0:
+            self.keyframes.append(self.previous.copy())
+        self.counts.append(simulation.get_count_history()[-1].copy())
+
+    @property
+    def duration(self):
+        # Number of days recorded after the first
+        return len(self.changes) - 1
+
+    @property
+    def nbytes(self):
+        # Memory used by the recorded arrays
+        return self.age.nbytes + self.previous.nbytes + sum(keyframe.nbytes for keyframe in self.keyframes) + \
+            sum(changed.nbytes + values.nbytes for changed, values in self.changes) + \
+            sum(counts.nbytes for counts in self.counts)
+
+    def get_count_history(self):
+        return np.array(self.counts)
+
+    def status(self, day):
+        """Status grid on a recorded day (counted from the first recorded day)"""
+        keyframe = day // self.keyframe_interval
+        status = self.keyframes[keyframe].copy()
+        for n in range(keyframe * self.keyframe_interval + 1, day + 1):
+            changed, values = self.changes[n]
+            status.reshape(-1)[changed] = values
+        return status
+
+    def replay(self):
+        """Returns a Replay, which can be used in place of the simulation by the animation, plot and export code"""
+        return Replay(self)
+
+
+class Replay:
+    """
+    The Replay class steps through a recorded History with the same interface the drawing code uses on a Simulation
+    (update, day, status, age, get_rgb_matrix, get_count_status and get_count_history).
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.width = history.width
+        self.height = history.height
+        self.STATUSES = history.STATUSES
+        self.COLOURMAP = history.COLOURMAP
+        self.COLOURMAP_RGB = history.COLOURMAP_RGB
+        self.age = history.age
+        self.age_grid = history.age
+        self.counts = history.get_count_history()
+        self.recorded_day = 0
+        self.status = history.status(0)
+        self.renderer = None
+        self.profiler = None  # A replay isn't profiled, as it doesn't simulate anything
+
+    @property
+    def day(self):
+        return self.history.start_day + self.recorded_day
+
+    def update(self):
+        # Moves on to the next recorded day by applying that day's changes
+        if self.recorded_day >= self.history.duration:
+            raise IndexError("No more days have been recorded")
+        self.recorded_day += 1
+        changed, values = self.history.changes[self.recorded_day]
+        self.status.reshape(-1)[changed] = values
+
+    def get_rgb_matrix(self, downsample=1, method="majority"):
+        if self.renderer is None:
+            self.renderer = Renderer(simulation_colours(self))
+        return self.renderer.render(self.status, self.age, downsample, method)
+
+    def get_status_grid(self):
+        return self.status.copy()
+
+    def get_age_grid(self):
+        return self.age.copy()
+
+    def get_count_history(self):
+        return self.counts[:self.recorded_day + 1]
+
+    def get_count_status(self):
+        return {status: int(self.counts[self.recorded_day, code]) for status, code in self.STATUSES.items()}
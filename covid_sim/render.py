@@ -0,0 +1,85 @@
+import numpy as np
+
+from covid_sim.kernels import N_STATUSES
+from covid_sim.simulator import MAX_AGE
+
+"""
+Render.py is used to turn the status and age grids into an rgb image for the animations and plots.
+Each status has its own colour and older people get a darker shade of it (their age is taken away from each non-zero
+colour channel). Every (status, age) pair therefore has a fixed colour, so a palette of all of them is built once and a
+frame is then just the palette indexed by the status and age grids.
+For grids much larger than the screen the image can be downsampled by a whole factor, either by taking the most common
+status in each block (majority) or by averaging the colours in each block (mean).
+"""
+
+
+def simulation_colours(simulation):
+    # Dictionary of status code -> (r, g, b) from a simulation's colour scheme
+    return {code: simulation.COLOURMAP_RGB[simulation.COLOURMAP[status]]
+            for status, code in simulation.STATUSES.items()}
+
+
+class Renderer:
+    """
+    The Renderer class holds the (status, age) -> rgb palette and reuses its output buffer between frames.
+    The array returned by render is overwritten by the next call, so copy it if it needs to be kept.
+    """
+
+    def __init__(self, colours):
+        # colours is a dictionary of status code -> (r, g, b)
+        self.palette = np.zeros((N_STATUSES, MAX_AGE, 3), dtype=np.uint8)
+        ages = np.arange(MAX_AGE).reshape(-1, 1)
+        for code, colour_rgb in colours.items():
+            colour_rgb = np.array(colour_rgb).reshape(1, -1)
+            # Produces a darker shade for older ages by taking their age value away from their rgb value
+            self.palette[code] = np.where(colour_rgb != 0, np.clip(colour_rgb - ages, 0, 255), 0)
+        self.out = None
+
+    def buffer(self, shape):
+        # Output buffer for an image of the given (rows, columns), only reallocated when the size changes
+        if self.out is None or self.out.shape[:2] != shape:
+            self.out = np.zeros((*shape, 3), dtype=np.uint8)
+        return self.out
+
+    def render(self, status, age, downsample=1, method="majority"):
+        """Returns the rgb image (uint8) of the grid, downsampled by a whole factor if downsample > 1"""
+        if downsample == 1:
+            out = self.buffer(status.shape)
+            np.take(self.palette.reshape(-1, 3), status.astype(np.intp) * MAX_AGE + age, axis=0, out=out)
+            return out
+        if method == "majority":
+            return self.render_majority(status, age, downsample)
+        elif method == "mean":
+            return self.render_mean(status, age, downsample)
+        raise ValueError(f"Unknown downsampling method: {method}")
+
+    @staticmethod
+    def blocks(grid, factor):
+        # View of the grid as (rows, factor, columns, factor) blocks, dropping any rows/columns that don't fill a block
+        rows, cols = grid.shape[0] // factor, grid.shape[1] // factor
+        return grid[:rows * factor, :cols * factor].reshape(rows, factor, cols, factor)
+
+    @staticmethod
+    def downsample(status, age, factor):
+        """Returns the most common status in each block and the block's mean age"""
+        status_blocks = Renderer.blocks(status, factor)
+        votes = np.stack([np.count_nonzero(status_blocks == code, axis=(1, 3)) for code in range(N_STATUSES)])
+        block_status = votes.argmax(axis=0).astype(np.uint8)
+        block_age = Renderer.blocks(age, factor).mean(axis=(1, 3)).astype(np.uint8)
+        return block_status, block_age
+
+    def render_majority(self, status, age, factor):
+        # Most common status in each block, shaded by the block's mean age
+        block_status, block_age = self.downsample(status, age, factor)
+        out = self.buffer(block_status.shape)
+        out[...] = self.palette[block_status, block_age]
+        return out
+
+    def render_mean(self, status, age, factor):
+        # Mean colour of each block
+        full = self.palette[status, age]
+        rows, cols = status.shape[0] // factor, status.shape[1] // factor
+        blocks = full[:rows * factor, :cols * factor].reshape(rows, factor, cols, factor, 3)
+        out = self.buffer((rows, cols))
+        out[...] = blocks.mean(axis=(1, 3))
+        return out
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
+import json
+import os
+from bisect import bisect_right
+
 import numpy as np
-from numpy.random import random, randint, choice
-from random import choices
+
+from covid_sim.kernels import SUSCEPTIBLE, RECOVERED, VACCINATED
+from covid_sim.kernels import N_STATUSES, count_infected_neighbours, apply_transitions, count_statuses
 
 """
 Simulator.py is used to generate the data needed to simulate our virus pandemic.
-This works by generating a matrix of person objects, each with their own attributes on how the virus will affect them.
+This works by generating a set of grids (numpy arrays), one element per person, holding each person's status, age and
+their own probabilities on how the virus will affect them.
 Each person has the chance to spread the virus to any of their neighbours, depending on their probabilities of infection
 Individuals can be of 4 different states; Susceptible, Infected, Recovered or Dead, during the epidemic.
 The simulation begins by randomly infecting a select number of individuals, by updating their status to infected
@@ -16,11 +22,38 @@ There are also additional parameters, through the Measures class, that may be se
 example, the Lockdown Measure will reduce the probability of infection for X number of days.
 """
 
-SUSCEPTIBLE = 0
-INFECTED = 1
-RECOVERED = 2
-DEAD = 3
-VACCINATED = 4
+AGE_RANGES = [range(0, 18), range(18, 30), range(30, 50), range(50, 70), range(70, 100)]
+AGE_RANGE_WEIGHTS = [0.22, 0.12, 0.31, 0.22, 0.13]
+MAX_AGE = AGE_RANGES[-1].stop
+
+
+def as_seed_sequence(seed=None):
+    # Accepts a SeedSequence, an integer seed or None (fresh entropy from the OS) and returns a SeedSequence
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def random_ages(shape, rng):
+    # Picks an age range by its weight for everyone at once and then an age uniformly within each person's range
+    lows = np.array([ages.start for ages in AGE_RANGES])
+    spans = np.array([len(ages) for ages in AGE_RANGES])
+    bands = rng.choice(len(AGE_RANGES), size=shape, p=AGE_RANGE_WEIGHTS)
+    return (lows[bands] + (rng.random(shape) * spans[bands]).astype(int)).astype(np.uint8)
+
+
+def age_probability(age, probabilities):
+    # Returns the probability for the first age band (upper bound) that the age falls below
+    for band, p in probabilities.items():
+        if age < int(band):
+            return p
+    return 0
+
+
+def probability_table(probabilities):
+    # Lookup table of the probability at each age (0 to 99), so a grid of ages can be mapped to probabilities by
+    # indexing
+    return np.array([age_probability(age, probabilities) for age in range(MAX_AGE)], dtype=np.float32)
 
 
 # Vaccination class
@@ -31,7 +64,8 @@ class Vaccinator:
     The Vaccine is designed to reduce the risk of infection, modelled by changing an individuals probabilities
     """
 
-    def __init__(self, start=20, rate=0.25, max=20):
+    def __init__(self, start=20, rate=0.25, max=20, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()  # Random stream used to pick people
         self.start_time = start  # Day the vaccine begins to be distributed
         self.vaccination_capacity_rate = rate  # How much to increase vaccination capacity each day
         self.vaccination_max_capacity = max  # Max vaccination capacity per day
@@ -44,57 +78,81 @@ class Vaccinator:
         else:
             self.vaccination_capacity = self.vaccination_max_capacity
 
-    def vaccinate(self, pop):
+    def vaccinate(self, status):
+        # Vaccinates people in place in the status grid
         self.increase_capacity()
-        new_pop = pop.copy()
-        eligible_to_vaccinate = [(i, j) for i in range(len(new_pop)) for j in range(len(new_pop[i])) if
-                                 new_pop[i, j].status == SUSCEPTIBLE or new_pop[i, j].status == RECOVERED]
-        # ^ Decides whether a Person is eligible to vaccinate (only if they are Susceptible or Recovered) ^
-        if int(self.vaccination_capacity) <= len(eligible_to_vaccinate):
-            people_to_vaccinate = choices(eligible_to_vaccinate, k=int(self.vaccination_capacity))
-        else:
-            people_to_vaccinate = eligible_to_vaccinate
-        for i, j in people_to_vaccinate:
-            new_pop[i, j].set_status(VACCINATED)
-        return new_pop  # Returns updated population with vaccinated persons
+        changes = np.zeros(N_STATUSES, dtype=np.int64)
+        capacity = int(self.vaccination_capacity)
+        if capacity > 0:
+            flat = status.reshape(-1)
+            people_to_vaccinate = self.choose_eligible(flat, capacity)
+            changes -= np.bincount(flat[people_to_vaccinate], minlength=N_STATUSES)
+            changes[VACCINATED] += len(people_to_vaccinate)
+            flat[people_to_vaccinate] = VACCINATED
+        return changes  # Returns the change in the number of people with each status
+
+    @staticmethod
+    def is_eligible(status):
+        # Decides whether a Person is eligible to vaccinate (only if they are Susceptible or Recovered)
+        return (status == SUSCEPTIBLE) | (status == RECOVERED)
+
+    def choose_eligible(self, flat, capacity):
+        """
+        Picks up to capacity different eligible people (flat positions) uniformly at random.
+
+        People are first drawn at random from the whole grid, skipping anyone ineligible or already picked, which costs
+        O(capacity) while a reasonable share of the population is eligible. Only if that doesn't find enough people
+        (few are left eligible) is the grid scanned for everyone eligible.
+        """
+        attempts = self.rng.integers(flat.size, size=4 * capacity + 16)
+        candidates = attempts[self.is_eligible(flat[attempts])]
+        _, first = np.unique(candidates, return_index=True)
+        if len(first) >= capacity:
+            return candidates[np.sort(first)[:capacity]]  # Keep the order they were drawn in
+
+        eligible = np.flatnonzero(self.is_eligible(flat[:]))
+        if len(eligible) <= capacity:
+            return eligible
+        return self.rng.choice(eligible, size=capacity, replace=False)
 
 
 # Person class
 class Person:
     """
-    The Person class creates each individual object to be added to the population
-    Each is assigned to an age range, which determines their infection, recovery and death probabilities
+    The Person class is a read-only view of one individual in the population
+    The population itself is stored as arrays on the Simulation, this is kept for compatibility so a single person can
+    still be inspected as an object
     """
 
-    def __init__(self, probabilities, infection_length=14):
-        self.status = SUSCEPTIBLE
-        self.infection_length = infection_length
-        self.age = choice(choice([range(0, 18), range(18, 30), range(30, 50), range(50, 70), range(70, 100)],
-                                 p=[0.22, 0.12, 0.31, 0.22, 0.13]))
-        self.recovery_probability = 0
-        self.infection_probability = 0
-        self.death_probability = 0
-        self.set_probabilities(probabilities)
-
-    def set_probabilities(self, probabilities):
-        # Assigns the input probabilities for each state to the different age ranges
-        for age, p in probabilities["Infection"].items():
-            if self.age < int(age):
-                self.infection_probability = p
-                break
-        for age, p in probabilities["Recovery"].items():
-            if self.age < int(age):
-                self.recovery_probability = p
-                break
-        for age, p in probabilities["Death"].items():
-            if self.age < int(age):
-                self.death_probability = p
-                break
-        self.recovery_probability /= self.infection_length
-        self.death_probability /= self.infection_length
-
-    def set_status(self, status):
-        self.status = status
+    def __init__(self, simulation, i, j):
+        self.simulation = simulation
+        self.i = i
+        self.j = j
+
+    @property
+    def status(self):
+        return int(self.simulation.status[self.i, self.j])
+
+    @property
+    def age(self):
+        return int(self.simulation.age[self.i, self.j])
+
+    @property
+    def infection_length(self):
+        return self.simulation.infection_length
+
+    # Probabilities include the multipliers of any measures in force
+    @property
+    def infection_probability(self):
+        return float(self.simulation.infection_probability[self.i, self.j]) * self.simulation.multipliers[0]
+
+    @property
+    def recovery_probability(self):
+        return float(self.simulation.recovery_probability[self.i, self.j]) * self.simulation.multipliers[1]
+
+    @property
+    def death_probability(self):
+        return float(self.simulation.death_probability[self.i, self.j]) * self.simulation.multipliers[2]
 
 
 # Measure class
@@ -104,6 +162,8 @@ class Measure:
     the spread of a virus.
     These are also modeled by changing probabilities.
     However, these will change all persons attributes for the set number of days the measure will last for.
+    The measures don't change the population themselves, they are combined into a MeasureSchedule which gives the
+    multiplier for each probability on each day.
     """
 
     def __init__(self, start_dates=(25,), end_dates=(75,), multiplier=0.5, probability_attr='infection_probability'):
@@ -112,31 +172,6 @@ class Measure:
         self.multiplier = multiplier  # chosen probabilities
         self.probability_attr = probability_attr
 
-    def update(self, pop, date):
-        if date in self.start_dates:
-            new_pop = self.start(pop.copy())
-        elif date in self.end_dates:  # Updates population attributes when Measure date is reached
-            new_pop = self.stop(pop.copy())
-        else:
-            new_pop = pop.copy()
-        return new_pop
-
-    def start(self, pop):
-        for i in range(len(pop)):
-            for j in range(len(pop)):
-                old_probability = getattr(pop[i, j], self.probability_attr)
-                new_probability = old_probability * self.multiplier
-                setattr(pop[i, j], self.probability_attr, new_probability)
-        return pop
-
-    def stop(self, pop):
-        for i in range(len(pop)):
-            for j in range(len(pop[i])):
-                old_probability = getattr(pop[i, j], self.probability_attr)
-                new_probability = old_probability / self.multiplier
-                setattr(pop[i, j], self.probability_attr, new_probability)
-        return pop
-
 
 # Series of subclasses of the Measure Class, representing different epidemic scenarios
 class Lockdown(Measure):
@@ -159,6 +194,69 @@ class Ventilators(Measure):
         super().__init__(starts, ends, multiplier, 'death_probability')
 
 
+def get_measures(measures):
+    # Creates the measures from their parameters (the "measures" part of the simulation parameters)
+    return [Lockdown(**measures["Lockdown"]),
+            SocialDistancing(**measures["Social Distancing"]),
+            ImprovedTreatment(**measures["Improved Treatment"]),
+            Ventilators(**measures["Ventilators"])]
+
+
+class MeasureSchedule:
+    """
+    The MeasureSchedule class is built once from all of the measures' start and end dates.
+    It keeps one multiplier per probability (infection, recovery, death) for each day an event happens on, which the
+    transitions then apply to the probabilities instead of every person's probabilities being changed in place.
+
+    A measure is in force while it has more windows started than ended, however many windows overlap, and the
+    multipliers of all of the measures in force on a probability are multiplied together. The multipliers are
+    recomputed from scratch at every event, so no error builds up from repeatedly multiplying and dividing.
+    """
+
+    PROBABILITIES = ('infection_probability', 'recovery_probability', 'death_probability')
+
+    def __init__(self, measures):
+        events = {}  # day -> list of (measure number, +1 for a start or -1 for an end)
+        for n, measure in enumerate(measures):
+            for day in measure.end_dates:
+                events.setdefault(day, []).append((n, -1))
+            for day in measure.start_dates:
+                events.setdefault(day, []).append((n, 1))
+
+        self.days = sorted(events)
+        self.values = []  # Multipliers in force from each day in self.days onwards
+        windows = [0] * len(measures)  # Number of open windows of each measure
+        for day in self.days:
+            # Ends are listed before starts, so a window ending on the day another starts carries straight on
+            for n, change in events[day]:
+                windows[n] = max(windows[n] + change, 0)
+            multipliers = []
+            for probability_attr in self.PROBABILITIES:
+                multiplier = 1.0
+                for n, measure in enumerate(measures):
+                    if windows[n] > 0 and measure.probability_attr == probability_attr:
+                        multiplier *= measure.multiplier
+                multipliers.append(multiplier)
+            self.values.append(tuple(multipliers))
+
+    def multipliers(self, day):
+        """Returns the (infection, recovery, death) multipliers in force on a day"""
+        n = bisect_right(self.days, day) - 1
+        return self.values[n] if n >= 0 else (1.0, 1.0, 1.0)
+
+
+def parse_parameters(params):
+    # Converts parameters in the shape of the defaults dictionary (where each measure has an "enabled" flag) into the
+    # keyword arguments of a Simulation - disabled measures get no start or end dates
+    kwargs = {**params, "measures": {}}
+    for measure, values in params["measures"].items():
+        enabled = values.get("enabled", True)
+        kwargs["measures"][measure] = {"starts": list(values["starts"]) if enabled else [],
+                                       "ends": list(values["ends"]) if enabled else [],
+                                       "multiplier": values["multiplier"]}
+    return kwargs
+
+
 class Simulation:
     """
     The simulation class is used to create the different matrices required to produce the animated simulation
@@ -203,116 +301,400 @@ class Simulation:
 
     def __init__(self, **kwargs):
         # Basic simulation parameters:
+        self.params = kwargs
         self.day = 0
+        # Every random component draws from its own stream, spawned from one seed so that runs can be reproduced
+        self.seed_sequence = as_seed_sequence(kwargs.get("seed"))
+        # Everything needed to rebuild the same seed (and so the same streams) from a checkpoint, including where it
+        # sits in a tree of spawned seeds
+        entropy = self.seed_sequence.entropy
+        self.seed_state = {"entropy": entropy if isinstance(entropy, int) else [int(e) for e in entropy],
+                           "spawn_key": [int(k) for k in self.seed_sequence.spawn_key],
+                           "pool_size": self.seed_sequence.pool_size,
+                           "n_children_spawned": self.seed_sequence.n_children_spawned}
+        population_seed, infection_seed, transition_seed, vaccination_seed = self.seed_sequence.spawn(4)
+        self.transition_seed = transition_seed
+        self.infection_rng = np.random.default_rng(infection_seed)
+        self.rng = np.random.default_rng(transition_seed)
         self.width = kwargs["size"]
         self.height = kwargs["size"]
+        self.infection_length = kwargs["length"]
+        # "grid" advances the whole grid at once with array operations, "cell" visits each person in turn, "frontier"
+        # only visits infected people and their neighbours (best for large grids with a small outbreak), "packed"
+        # stores the grid at half a byte per person (best for grids too large to fit in memory otherwise) and "network"
+        # takes everyone's contacts from a contact network rather than their neighbours on the grid
+        self.engine = kwargs.get("engine", "grid")
+        if self.engine not in ("grid", "cell", "frontier", "packed", "network"):
+            raise ValueError(f"Unknown simulation engine: {self.engine}")
+
+        # Optionally save a checkpoint to checkpoint_path every checkpoint_every days
+        self.checkpoint_every = kwargs.get("checkpoint_every")
+        self.checkpoint_path = kwargs.get("checkpoint_path")
+        if self.checkpoint_every and self.checkpoint_path is None:
+            raise ValueError("checkpoint_every needs a checkpoint_path to save the checkpoints to")
 
         # Initialise Population (everyone susceptible with range of ages assigned to each element)
-        self.pop = np.zeros((kwargs["size"], kwargs["size"]), dtype=Person)
-        for i in range(len(self.pop)):
-            for j in range(len(self.pop[i])):
-                self.pop[i, j] = Person(kwargs["probabilities"], kwargs["length"])
-
-        self.age_grid = self.get_age_grid()
+        # The population is stored as a struct of arrays, one element per person
+        shape = (self.width, self.height)
+        probabilities = kwargs["probabilities"]
+        self.packed = None
+        if self.engine == "packed":
+            # Only the packed status and age band grids are kept (see packed.py), not the arrays below
+            from covid_sim.packed import PackedEngine
+            self.packed = PackedEngine(shape, probabilities, self.infection_length,
+                                       np.random.default_rng(population_seed))
+            self.status_buffers = self.neighbours = self.draws = None
+            self.age = self.infection_probability = self.recovery_probability = self.death_probability = None
+        else:
+            # The status is double buffered: today's status is read from the front buffer and tomorrow's written into
+            # the back buffer, which are then swapped. Both are allocated once here and reused every day.
+            # The frontier engine updates today's grid in place, so it only needs the front buffer and no whole-grid
+            # scratch arrays.
+            if self.engine == "frontier":
+                self.status_buffers = np.full((1, *shape), self.SUSCEPTIBLE, dtype=np.uint8)
+                self.neighbours = self.draws = None
+            else:
+                self.status_buffers = np.full((2, *shape), self.SUSCEPTIBLE, dtype=np.uint8)
+                # Number of infected neighbours, reused every day (the network engine uses its contacts instead)
+                self.neighbours = np.zeros(shape, dtype=np.uint8) if self.engine != "network" else None
+                self.draws = np.zeros(shape, dtype=np.float32)  # Random draws for the day's transitions, reused daily
+            # Sample everyone's age in one draw, then map ages to probabilities with lookup tables built once
+            self.age = random_ages(shape, np.random.default_rng(population_seed))
+            self.infection_probability = probability_table(probabilities["Infection"])[self.age]
+            self.recovery_probability = (probability_table(probabilities["Recovery"]) / self.infection_length)[self.age]
+            self.death_probability = (probability_table(probabilities["Death"]) / self.infection_length)[self.age]
+        self.front = 0
+
+        self.age_grid = self.age
+
+        # Contacts for the network engine, by default the grid's own neighbours (people are numbered by flat position)
+        self.network = None
+        if self.engine == "network":
+            from covid_sim.network import ContactNetwork
+            self.network = kwargs.get("network") or ContactNetwork.lattice(self.width, self.height)
+            if self.network.n_nodes != self.width * self.height:
+                raise ValueError(f"The network has {self.network.n_nodes} people but the grid has "
+                                 f"{self.width * self.height}")
+
+        self.frontier = None
+        if self.engine == "frontier":
+            from covid_sim.frontier import Frontier
+            self.frontier = Frontier(self.status)
+
+        # Optionally split the grid engine's work across several processes, with per-block random streams derived from
+        # the transition stream's seed so the results don't depend on the number of workers
+        self.tiles = None
+        if kwargs.get("workers") is not None:
+            if self.engine != "grid":
+                raise ValueError("workers can only be used with the grid engine")
+            from covid_sim.parallel import TiledEngine
+            self.tiles = TiledEngine(self, kwargs["workers"], transition_seed)
+
+        self.vaccinator = Vaccinator(**kwargs["vaccinator"], rng=np.random.default_rng(vaccination_seed))
+        self.measures = get_measures(kwargs["measures"])
+        self.schedule = MeasureSchedule(self.measures)
+        self.multipliers = self.schedule.multipliers(self.day)  # Multipliers used for the latest day
+
+        self.renderer = None  # Created the first time an rgb matrix is needed
+
+        # Optionally stream every day to a trajectory folder on disk as the simulation runs
+        self.trajectory = None
+        if kwargs.get("trajectory") is not None:
+            from covid_sim.trajectory import TrajectoryWriter
+            self.trajectory = TrajectoryWriter(kwargs["trajectory"], self)
+
+        # Optionally record the time taken by each phase of every day (see profiling.py)
+        self.profiler = None
+        if kwargs.get("profile"):
+            from covid_sim.profiling import Profiler
+            self.profiler = Profiler()
+
+        # Running count of people with each status, kept up to date from each day's changes, and the counts on every
+        # day so far (grown as needed)
+        self.counts = self.packed.count_statuses() if self.packed is not None else count_statuses(self.status)
+        self.history = np.zeros((kwargs.get("duration", 100) + 1, N_STATUSES), dtype=np.int64)
+        self.record_counts()
+
+    @property
+    def status(self):
+        # Today's status grid (front buffer) - for the packed engine this is an unpacked copy, so changes to it are lost
+        if self.packed is not None:
+            return self.packed.status_grid()
+        return self.status_buffers[self.front]
+
+    @property
+    def cells(self):
+        # Today's status of everyone as a flat array (or packed grid) which can be written to by position
+        if self.packed is not None:
+            return self.packed.status
+        return self.status.reshape(-1)
+
+    @property
+    def next_status(self):
+        # Tomorrow's status grid (back buffer), only meaningful while a day is being computed
+        return self.status_buffers[1 - self.front]
+
+    def swap_buffers(self):
+        self.front = 1 - self.front
+
+    @property
+    def pop(self):
+        # Grid of read-only Person views, only kept for compatibility - never used when running the simulation
+        pop = np.empty((self.width, self.height), dtype=object)
+        for i in range(self.width):
+            for j in range(self.height):
+                pop[i, j] = Person(self, i, j)
+        return pop
 
-        self.vaccinator = Vaccinator(**kwargs["vaccinator"])
-        self.measures = [Lockdown(**kwargs["measures"]["Lockdown"]),
-                         SocialDistancing(**kwargs["measures"]["Social Distancing"]),
-                         ImprovedTreatment(**kwargs["measures"]["Improved Treatment"]),
-                         Ventilators(**kwargs["measures"]["Ventilators"])]
+    def close(self):
+        # Shut down any worker processes and free their shared memory (the grids are moved back into private arrays)
+        if self.tiles is not None:
+            self.tiles.close(self)
+        if self.trajectory is not None:
+            self.trajectory.close()
+
+    def save_checkpoint(self, path):
+        """
+        Saves everything needed to carry on the simulation later (an .npz file): the state arrays, day, count history,
+        vaccination capacity and the state of every random stream. The measure multipliers are worked out again from
+        the day. The file is written to a temporary name first, so an interruption never leaves a broken checkpoint.
+        """
+        params = {k: v for k, v in self.params.items() if k not in ("seed", "trajectory", "network")}
+        meta = {
+            "params": params,
+            "seed": self.seed_state,
+            "day": self.day,
+            "vaccination_capacity": self.vaccinator.vaccination_capacity,
+            "rng": self.rng.bit_generator.state,
+            "infection_rng": self.infection_rng.bit_generator.state,
+            "vaccination_rng": self.vaccinator.rng.bit_generator.state,
+        }
+        if self.packed is not None:
+            arrays = {"packed_status": self.packed.status.data, "packed_bands": self.packed.bands.data}
+        else:
+            arrays = {
+                "status": self.status,
+                "age": self.age,
+                "infection_probability": self.infection_probability,
+                "recovery_probability": self.recovery_probability,
+                "death_probability": self.death_probability,
+            }
+        arrays["history"] = self.get_count_history()
+        if self.network is not None:
+            arrays.update(network_indptr=self.network.indptr, network_indices=self.network.indices)
+            if self.network.weights is not None:
+                arrays["network_weights"] = self.network.weights
+        if self.frontier is not None:
+            arrays["frontier"] = self.frontier.infected  # Order matters for which random draw goes to whom
+        temporary = f"{path}.tmp.npz"
+        np.savez(temporary, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load_checkpoint(cls, path, **overrides):
+        """
+        Creates a simulation from a checkpoint, carrying on exactly where it was saved (the rest of the run is
+        identical to one that was never interrupted). overrides replace any of the saved parameters, e.g. workers.
+        """
+        with np.load(path) as checkpoint:
+            meta = json.loads(str(checkpoint["meta"]))
+            if "network_indptr" in checkpoint:
+                from covid_sim.network import ContactNetwork
+                weights = checkpoint["network_weights"] if "network_weights" in checkpoint else None
+                overrides = {"network": ContactNetwork(checkpoint["network_indptr"], checkpoint["network_indices"],
+                                                       weights), **overrides}
+            seed = meta["seed"]
+            if isinstance(seed, dict):
+                seed = np.random.SeedSequence(seed["entropy"], spawn_key=tuple(seed["spawn_key"]),
+                                              pool_size=seed["pool_size"],
+                                              n_children_spawned=seed["n_children_spawned"])
+            simulation = cls(**{**meta["params"], "seed": seed, **overrides})
+            simulation.day = meta["day"]
+            if simulation.packed is not None:
+                np.copyto(simulation.packed.status.data, checkpoint["packed_status"])
+                np.copyto(simulation.packed.bands.data, checkpoint["packed_bands"])
+            else:
+                for name in ("age", "infection_probability", "recovery_probability", "death_probability"):
+                    np.copyto(getattr(simulation, name), checkpoint[name])
+                np.copyto(simulation.status, checkpoint["status"])
+            history = checkpoint["history"]
+            simulation.history = np.zeros((max(len(history), len(simulation.history)), N_STATUSES), dtype=np.int64)
+            simulation.history[:len(history)] = history
+            if simulation.frontier is not None:
+                if "frontier" in checkpoint:
+                    simulation.frontier.infected = checkpoint["frontier"]
+                else:
+                    simulation.frontier.infected = np.flatnonzero(simulation.status == simulation.INFECTED)
+        simulation.counts = simulation.packed.count_statuses() if simulation.packed is not None else \
+            count_statuses(simulation.status)
+        simulation.multipliers = simulation.schedule.multipliers(simulation.day)
+        simulation.vaccinator.vaccination_capacity = meta["vaccination_capacity"]
+        simulation.rng.bit_generator.state = meta["rng"]
+        simulation.infection_rng.bit_generator.state = meta["infection_rng"]
+        simulation.vaccinator.rng.bit_generator.state = meta["vaccination_rng"]
+        return simulation
+
+    def get_person(self, i, j):
+        return Person(self, i, j)
 
     def infect_randomly(self, num):
+        cells = self.cells
+        infected = []  # Newly infected positions, added to the frontier all at once
         for n in range(num):
             # Choose a random x, y coordinate and make that person infected, do this n number of times
-            i = randint(self.width)
-            j = randint(self.height)
-            self.pop[i, j].set_status(self.INFECTED)
+            i = self.infection_rng.integers(self.width)
+            j = self.infection_rng.integers(self.height)
+            position = i * self.height + j
+            status = cells[position]
+            if status != self.INFECTED:
+                self.counts[status] -= 1
+                self.counts[self.INFECTED] += 1
+                cells[position] = self.INFECTED
+                infected.append(position)
+        if self.frontier is not None and infected:
+            self.frontier.add_infected(infected)
+        self.record_counts()
+
+    def record_counts(self):
+        # Store today's counts in the history, doubling its length when it is full
+        if self.day >= len(self.history):
+            self.history = np.concatenate([self.history, np.zeros_like(self.history)])
+        self.history[self.day] = self.counts
 
     def update(self):
         # Advance the simulation by one day
-        old_pop = self.pop
-        new_pop = old_pop.copy()
-        # Use a copy of the old state to store the new state so that e.g. if
-        # someone recovers but was infected yesterday their neighbours might
-        # still become infected today.
+        # Vaccinations and measures are applied to today's state first. After that every person's new status is
+        # computed only from today's (front) grid and written into tomorrow's (back) grid, so the result does not
+        # depend on the order people are visited in.
+        if self.trajectory is not None and self.trajectory.days == 0:
+            self.trajectory.append(self)  # The starting day (including any initial infections)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start(self.day)
+
+        vaccinated = 0
         if self.vaccinator.start_time <= self.day:
-            new_pop = self.vaccinator.vaccinate(old_pop)
-
-        for measure in self.measures:
-            new_pop = measure.update(new_pop, self.day)
-
-        for i in range(self.width):
-            for j in range(self.height):
-                self.set_new_status(new_pop, i, j)
-        self.pop = new_pop
+            vaccination = self.vaccinator.vaccinate(self.cells)
+            self.counts += vaccination
+            vaccinated = vaccination[self.VACCINATED]
+        if profiler is not None:
+            profiler.lap("vaccination")
+
+        self.multipliers = self.schedule.multipliers(self.day)
+        if profiler is not None:
+            profiler.lap("measures")
+
+        changes = np.zeros(N_STATUSES, dtype=np.int64)
+        visited = self.width * self.height
+        if self.engine == "frontier":
+            # The frontier only touches the people that can change, so it updates today's grid in place rather than
+            # filling the whole back buffer
+            cells, _ = self.frontier.step(self.status, self.infection_probability, self.recovery_probability,
+                                          self.death_probability, self.multipliers, self.rng, changes=changes)
+            visited = len(cells)
+        elif self.engine == "packed":
+            # Updated in place a tile at a time, so there is no back buffer
+            self.packed.step(self.multipliers, self.rng, changes=changes)
+        else:
+            if self.tiles is not None:
+                changes += self.tiles.step(self.front, self.day, self.multipliers)
+            elif self.engine == "grid":
+                self.update_grid(changes)
+            elif self.engine == "network":
+                self.update_network(changes)
+            else:
+                np.copyto(self.next_status, self.status)
+                for i in range(self.width):
+                    for j in range(self.height):
+                        self.set_new_status(self.status, self.next_status, i, j)
+                changes += count_statuses(self.next_status) - self.counts
+            self.swap_buffers()
+        if profiler is not None:
+            profiler.lap("transitions")
+            # Everyone who recovered or died was infected, so new infections are the net change in infections plus
+            # those who left it
+            left = changes[self.RECOVERED] + changes[self.DEAD]
+            profiler.count(visited, int(changes[self.INFECTED] + 2 * left + vaccinated))
+
+        self.counts += changes
         self.day += 1
-
-    def set_new_status(self, pop, i, j):
-        # Compute new status for person at i, j in the grid
-        person = pop[i, j]
+        self.record_counts()
+        if profiler is not None:
+            profiler.lap("counting")
+        if self.trajectory is not None:
+            self.trajectory.append(self)
+        if self.checkpoint_every and self.day % self.checkpoint_every == 0:
+            self.save_checkpoint(self.checkpoint_path)
+        if profiler is not None:
+            profiler.lap("recording")
+
+    def update_grid(self, changes):
+        # Compute the new status of everyone at once from the number of infected neighbours around each person
+        count_infected_neighbours(self.status, out=self.neighbours)
+        self.rng.random(dtype=np.float32, out=self.draws)
+        apply_transitions(self.status, self.neighbours, self.draws, self.infection_probability,
+                          self.recovery_probability, self.death_probability, out=self.next_status,
+                          multipliers=self.multipliers, changes=changes)
+
+    def update_network(self, changes):
+        # As update_grid, but the infection pressure on everyone comes from their infected contacts in the network
+        pressure = self.network.pressure((self.status == self.INFECTED).reshape(-1)).reshape(self.status.shape)
+        self.rng.random(dtype=np.float32, out=self.draws)
+        apply_transitions(self.status, pressure, self.draws, self.infection_probability,
+                          self.recovery_probability, self.death_probability, out=self.next_status,
+                          multipliers=self.multipliers, changes=changes)
+
+    def set_new_status(self, status, new_status, i, j):
+        # Compute new status for person at i, j in the grid from today's status, storing it in new_status
+        infection_multiplier, recovery_multiplier, death_multiplier = self.multipliers
 
         # Update infected person
-        if person.status == self.INFECTED:
-            if person.recovery_probability > random():
-                person.set_status(self.RECOVERED)
-            elif person.death_probability > random():
-                person.set_status(self.DEAD)
+        if status[i, j] == self.INFECTED:
+            if self.recovery_probability[i, j] * recovery_multiplier > self.rng.random():
+                new_status[i, j] = self.RECOVERED
+            elif self.death_probability[i, j] * death_multiplier > self.rng.random():
+                new_status[i, j] = self.DEAD
 
         # Update susceptible person
-        elif person.status == self.SUSCEPTIBLE:
-            num = self.num_infected_around(pop, i, j)
-            if num * person.infection_probability > random():
-                person.set_status(self.INFECTED)
+        elif status[i, j] == self.SUSCEPTIBLE:
+            num = self.num_infected_around(status, i, j)
+            if num * self.infection_probability[i, j] * infection_multiplier > self.rng.random():
+                new_status[i, j] = self.INFECTED
 
-    def num_infected_around(self, pop, i, j):
+    def num_infected_around(self, status, i, j):
         # Count the number of infected people around person i, j
         # ivals and jvals are the coordinates of neighbours around i, j
-        ivals = range(max(i - 1, 0), min(i + 2, self.width))
-        jvals = range(max(j - 1, 0), min(j + 2, self.height))
-        number = 0
-        for ip in ivals:
-            for jp in jvals:
-                # Don't count self as a neighbour
-                if (ip, jp) != (i, j):
-                    if pop[ip, jp].status == self.INFECTED:
-                        number += 1
+        ivals = slice(max(i - 1, 0), min(i + 2, self.width))
+        jvals = slice(max(j - 1, 0), min(j + 2, self.height))
+        number = np.count_nonzero(status[ivals, jvals] == self.INFECTED)
+        # Don't count self as a neighbour
+        if status[i, j] == self.INFECTED:
+            number -= 1
         return number
 
     def get_count_status(self):
-        # Dictionary giving counts of people's status
-
-        simgrid = self.get_status_grid()
-        total = self.width * self.height
+        # Dictionary giving counts of people's status (from the running counts, so no need to look at the grid)
         counts = {}
         for status, statusnum in self.STATUSES.items():
-            counts[status] = np.count_nonzero(simgrid == statusnum)
+            counts[status] = int(self.counts[statusnum])
         return counts
 
-    def get_rgb_matrix(self):
-        rgb_matrix = np.zeros((self.width, self.height, 3), int)
-        code_to_status = {v: k for k, v in
-                          self.STATUSES.items()}  # Gets rbg data from previously declared colour scheme
-        for i in range(len(self.pop)):
-            for j in range(len(self.pop[i])):
-                person = self.pop[i, j]
-                age = person.age
-                colour_name = self.COLOURMAP[code_to_status[person.status]]
-                colour_rgb = self.COLOURMAP_RGB[colour_name]
-                age_adjusted_colour_rgb = [c - age if c != 0 else 0 for c in colour_rgb]
-                rgb_matrix[i, j] = age_adjusted_colour_rgb
-                # Prodcues a darker shade for older ages by taking their age value away from their rgb value
-        return rgb_matrix
+    def get_count_history(self):
+        # Counts of each status on every day so far, shape (day + 1, 5) indexed by day then status code
+        return self.history[:self.day + 1]
+
+    def get_rgb_matrix(self, downsample=1, method="majority"):
+        # Rgb image of the grid from the renderer's (status, age) palette - the array is reused by the next call
+        if self.renderer is None:
+            from covid_sim.render import Renderer, simulation_colours
+            self.renderer = Renderer(simulation_colours(self))  # Gets rbg data from previously declared colour scheme
+        return self.renderer.render(self.status, self.get_age_grid() if self.packed else self.age, downsample, method)
 
     def get_status_grid(self):
-        state = np.zeros(self.pop.shape)
-        for i in range(len(state)):
-            for j in range(len(state[i])):
-                state[i, j] = self.pop[i, j].status
-        return state
+        return self.status.copy()
 
     def get_age_grid(self):
-        age = np.zeros(self.pop.shape)
-        for i in range(len(age)):
-            for j in range(len(age[i])):
-                age[i, j] = self.pop[i, j].age
-        return age
+        # The packed engine doesn't keep exact ages, so everyone is given the middle age of their age band
+        if self.packed is not None:
+            return self.packed.ages()
+        return self.age.copy()
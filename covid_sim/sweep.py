@@ -0,0 +1,153 @@
+import copy
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from covid_sim.simulator import Simulation, parse_parameters, as_seed_sequence
+
+"""
+Sweep.py is used to run the simulation for many different parameter values (e.g. the Lockdown multiplier, the
+Vaccinator rate or the infection probabilities) without editing main.py or the web app for every point.
+Each point is a set of overrides applied to the parameters dictionary (the same shape as defaults in main.py), where the
+path to each parameter is its keys joined by "-" - the same naming the web app uses for its inputs, e.g.
+"measures-Lockdown-multiplier" or "probabilities-Infection-50".
+
+Points are run in parallel with a process pool and each result is appended to a results file (one JSON object per line)
+as soon as it finishes. Every point uses the same seed (common random numbers), so differences between points come from
+the parameters rather than the random draws. Re-running an interrupted sweep with the same results file skips the
+points already in it, and runs the rest with the seed stored with those results.
+"""
+
+
+def grid_points(grid):
+    """Returns every combination of the values in grid, a dictionary of parameter path -> list of values"""
+    paths = list(grid)
+    return [dict(zip(paths, values)) for values in itertools.product(*grid.values())]
+
+
+def apply_overrides(params, overrides):
+    """Returns a copy of params with each parameter path in overrides set to its value"""
+    params = copy.deepcopy(params)
+    for path, value in overrides.items():
+        d = params
+        *keys, last = path.split("-")
+        for key in keys:
+            d = d[find_key(d, key, path)]
+        d[find_key(d, last, path)] = value
+    return params
+
+
+def find_key(d, key, path):
+    # Matches the path part against the dictionary keys as strings, so integer keys (age bands) can be used in paths.
+    # A part matching no key is refused rather than added, so a misspelt path doesn't silently run the base parameters
+    if isinstance(d, dict):
+        for k in d:
+            if str(k) == key:
+                return k
+    raise KeyError(f"No parameter {path!r} (at {key!r})")
+
+
+def plain_values(overrides):
+    # Numpy scalars (e.g. values from np.arange) as plain Python values, so points can be stored as JSON
+    return {path: value.item() if isinstance(value, np.generic) else value for path, value in overrides.items()}
+
+
+def point_key(overrides):
+    # Canonical form of a point used to recognise results that are already done
+    return json.dumps(plain_values(overrides), sort_keys=True)
+
+
+def run_point(params, duration):
+    """Runs one simulation and returns the counts of each status on each day (day 0 to duration)"""
+    simulation = Simulation(**parse_parameters(params))
+    simulation.infect_randomly(params["cases"])
+    for day in range(duration):
+        simulation.update()
+    simulation.close()
+    return simulation.get_count_history().tolist()
+
+
+class ResultsStore:
+    """
+    The ResultsStore class is an append-only file of results, one JSON object per line.
+    A line left incomplete by an interrupted run is ignored when reading.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[result["key"]] = result
+        return results
+
+    def append(self, result):
+        with open(self.path, "a+b") as f:
+            # End a line left incomplete by an interrupted run first, so this result gets a line of its own
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write((json.dumps(result) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class Sweep:
+    """
+    The Sweep class runs a list of points (dictionaries of overrides, e.g. from grid_points) against base parameters.
+    """
+
+    def __init__(self, params, points, results_path, duration=None, workers=None, seed=None):
+        self.params = params
+        self.points = [plain_values(point) for point in points]
+        for point in self.points:
+            apply_overrides(params, point)  # Raises KeyError straight away for a path that isn't a parameter
+        self.store = ResultsStore(results_path)
+        self.seed = self.get_seed(seed if seed is not None else params.get("seed"))
+        self.duration = duration if duration is not None else params["duration"]
+        self.workers = workers
+
+    def get_seed(self, seed):
+        # The seed every point is run with. Without one, a resumed sweep carries on with the seed of the results
+        # already stored (a new sweep gets fresh entropy); a different seed is refused, as the points wouldn't share
+        # random numbers
+        stored = {result["seed"] for result in self.store.load().values()}
+        if len(stored) > 1:
+            raise ValueError(f"The results in {self.store.path} were run with different seeds")
+        if seed is None:
+            return stored.pop() if stored else as_seed_sequence(None).entropy
+        seed = as_seed_sequence(seed).entropy
+        if stored and seed not in stored:
+            raise ValueError(f"The results in {self.store.path} were run with seed {stored.pop()}, not {seed}")
+        return seed
+
+    def pending(self):
+        # Points which don't have a result yet
+        done = self.store.load()
+        return [point for point in self.points if point_key(point) not in done]
+
+    def run(self):
+        """Runs every point that isn't already done and returns all of the results keyed by point"""
+        pending = self.pending()
+        if pending:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(run_point, apply_overrides({**self.params, "seed": self.seed}, point),
+                                           self.duration): point
+                           for point in pending}
+                for future in as_completed(futures):
+                    point = futures[future]
+                    self.store.append({"key": point_key(point), "overrides": point, "seed": self.seed,
+                                       "counts": future.result()})
+        return self.store.load()
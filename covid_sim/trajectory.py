@@ -0,0 +1,179 @@
+import json
+import os
+
+import numpy as np
+
+from covid_sim.kernels import N_STATUSES
+
+"""
+Trajectory.py is used to stream the whole trajectory of a long simulation to disk as it runs, in a compact form that
+can be read back a day at a time without loading the whole file.
+
+A trajectory is a folder of append-only files:
+    meta.json       - grid size, keyframe interval and status bits
+    age.bin         - everyone's age (uint8), written once
+    keyframes.bin   - a full copy of the status grid every keyframe_interval days, packed 3 bits per person
+    positions.bin   - flat positions (uint32) of everyone whose status changed, day after day
+    values.bin      - their new statuses (uint8)
+    index.bin       - number of changes recorded up to the end of each day (int64), one entry per day
+    counts.bin      - count of each status on each day (int64)
+Every file is read through np.memmap, so any day can be rebuilt from its keyframe and the few days of changes after it.
+The day count comes from index.bin, so a trajectory cut short by a crash can still be read up to its last complete day.
+"""
+
+STATUS_BITS = 3  # Five statuses fit in three bits
+
+
+def pack_statuses(status):
+    """Packs a grid of statuses into 3 bits per person (8 people in 3 bytes)"""
+    flat = status.reshape(-1).astype(np.uint32)
+    groups = np.zeros(-(-len(flat) // 8) * 8, dtype=np.uint32)
+    groups[:len(flat)] = flat
+    groups = groups.reshape(-1, 8)
+    packed = np.zeros(len(groups), dtype=np.uint32)
+    for k in range(8):
+        packed |= groups[:, k] << (STATUS_BITS * k)
+    return packed.view(np.uint8).reshape(-1, 4)[:, :3].reshape(-1).copy()
+
+
+def unpack_statuses(packed, shape):
+    """Unpacks a grid of statuses packed by pack_statuses"""
+    n = int(np.prod(shape))
+    groups = np.zeros((len(packed) // 3, 4), dtype=np.uint8)
+    groups[:, :3] = np.asarray(packed).reshape(-1, 3)
+    groups = groups.view(np.uint32).reshape(-1)
+    status = np.zeros((len(groups), 8), dtype=np.uint8)
+    for k in range(8):
+        status[:, k] = (groups >> (STATUS_BITS * k)) & 0b111
+    return status.reshape(-1)[:n].reshape(shape)
+
+
+def packed_size(shape):
+    # Number of bytes in one packed grid
+    return -(-int(np.prod(shape)) // 8) * 3
+
+
+class TrajectoryWriter:
+    """
+    The TrajectoryWriter class appends days to a trajectory folder as the simulation produces them.
+    """
+
+    def __init__(self, path, simulation, keyframe_interval=10):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"width": simulation.width, "height": simulation.height, "start_day": simulation.day,
+                       "keyframe_interval": keyframe_interval, "status_bits": STATUS_BITS}, f)
+        simulation.get_age_grid().tofile(os.path.join(path, "age.bin"))
+        self.files = {name: open(os.path.join(path, f"{name}.bin"), "wb")
+                      for name in ("keyframes", "positions", "values", "index", "counts")}
+        self.days = 0
+        self.n_changes = 0
+        self.previous = None
+
+    def append(self, simulation):
+        """Writes the simulation's current day"""
+        status = simulation.status
+        if self.previous is None:
+            self.previous = status.copy()
+        else:
+            changed = np.flatnonzero(status != self.previous).astype(np.uint32)
+            self.files["positions"].write(changed.tobytes())
+            self.files["values"].write(status.reshape(-1)[changed].tobytes())
+            self.n_changes += len(changed)
+            np.copyto(self.previous, status)
+        if self.days % self.keyframe_interval == 0:
+            self.files["keyframes"].write(pack_statuses(status).tobytes())
+        self.files["counts"].write(simulation.get_count_history()[-1].astype(np.int64).tobytes())
+        # The index is written last so a day only counts once all of its data is in the files
+        for name in ("keyframes", "positions", "values", "counts"):
+            self.files[name].flush()
+        self.files["index"].write(np.int64(self.n_changes).tobytes())
+        self.files["index"].flush()
+        self.days += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def memmap(path, dtype):
+    # Memory maps the whole items in a file, allowing for it being empty or ending in a partial item left by a crash
+    items = os.path.getsize(path) // np.dtype(dtype).itemsize
+    if items == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(items,))
+
+
+class Trajectory:
+    """
+    The Trajectory class reads a trajectory folder. It has the same interface as a recorded History (status(day),
+    changes, get_count_history and replay), so the animation and plots can be drawn straight from disk.
+    """
+
+    def __init__(self, path):
+        from covid_sim.simulator import Simulation
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.start_day = meta["start_day"]
+        self.keyframe_interval = meta["keyframe_interval"]
+        self.shape = (self.width, self.height)
+        self.STATUSES = Simulation.STATUSES
+        self.COLOURMAP = Simulation.COLOURMAP
+        self.COLOURMAP_RGB = Simulation.COLOURMAP_RGB
+
+        self.age = np.fromfile(os.path.join(path, "age.bin"), dtype=np.uint8).reshape(self.shape)
+        self.index = memmap(os.path.join(path, "index.bin"), np.int64)
+        self.keyframes = memmap(os.path.join(path, "keyframes.bin"), np.uint8)
+        self.positions = memmap(os.path.join(path, "positions.bin"), np.uint32)
+        self.values = memmap(os.path.join(path, "values.bin"), np.uint8)
+        self.counts = memmap(os.path.join(path, "counts.bin"), np.int64)
+        self.days = len(self.index)
+        self.changes = ChangeList(self)
+
+    @property
+    def duration(self):
+        # Number of days recorded after the first
+        return self.days - 1
+
+    def get_count_history(self):
+        return np.array(self.counts[:self.days * N_STATUSES]).reshape(self.days, N_STATUSES)
+
+    def day_changes(self, day):
+        # Flat positions and new statuses of everyone who changed on a day
+        start = self.index[day - 1] if day > 0 else 0
+        stop = self.index[day]
+        return self.positions[start:stop], self.values[start:stop]
+
+    def status(self, day):
+        """Status grid on a recorded day (counted from the first recorded day)"""
+        if not 0 <= day < self.days:
+            raise IndexError(f"Day {day} has not been recorded")
+        keyframe = day // self.keyframe_interval
+        size = packed_size(self.shape)
+        status = unpack_statuses(self.keyframes[keyframe * size:(keyframe + 1) * size], self.shape)
+        for n in range(keyframe * self.keyframe_interval + 1, day + 1):
+            changed, values = self.day_changes(n)
+            status.reshape(-1)[changed] = values
+        return status
+
+    def replay(self):
+        from covid_sim.recorder import Replay
+        return Replay(self)
+
+
+class ChangeList:
+    # Sequence of each day's (positions, statuses) changes, read from the memory mapped files when indexed
+
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+
+    def __len__(self):
+        return self.trajectory.days
+
+    def __getitem__(self, day):
+        return self.trajectory.day_changes(day)
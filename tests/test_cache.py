@@ -0,0 +1,114 @@
+import os
+import threading
+
+import pytest
+
+from web_app.cache import CachedRun, ResultCache, parameters_key
+
+"""
+Checks the web app's least recently used cache of runs: moving runs to disk and back, the budgets and the folder used.
+"""
+
+
+class FakeHistory:
+    # Stands in for a recorded History, with a set size
+    def __init__(self, nbytes, label):
+        self.nbytes = nbytes
+        self.label = label
+
+
+def get_run(label, nbytes=100):
+    return CachedRun(FakeHistory(nbytes, label))
+
+
+def test_parameters_key():
+    assert parameters_key({"size": 10, "seed": 1}) == parameters_key({"seed": 1, "size": 10})
+    assert parameters_key({"size": 10, "duration": 5}) == parameters_key({"size": 10, "duration": 50})
+    assert parameters_key({"size": 10}) != parameters_key({"size": 11})
+
+
+def test_spill_and_reload(tmp_path):
+    cache = ResultCache(memory_budget=250, path=str(tmp_path / "cache"))
+    for label in "abc":
+        cache.put(label, get_run(label))
+    # The least recently used run went to disk
+    assert list(cache.memory) == ["b", "c"]
+    assert list(cache.disk) == ["a"]
+    assert os.path.exists(cache.filename("a"))
+
+    run = cache.get("a")
+    assert run.history.label == "a"
+    assert not os.path.exists(cache.filename("a"))
+    assert list(cache.memory) == ["c", "a"]
+    assert list(cache.disk) == ["b"]
+
+
+def test_get_marks_recently_used(tmp_path):
+    cache = ResultCache(memory_budget=250, path=str(tmp_path / "cache"))
+    cache.put("a", get_run("a"))
+    cache.put("b", get_run("b"))
+    cache.get("a")
+    cache.put("c", get_run("c"))
+    assert list(cache.disk) == ["b"]
+
+
+def test_disk_budget(tmp_path):
+    cache = ResultCache(memory_budget=100, disk_budget=1000, path=str(tmp_path / "cache"))
+    for label in "abcdefghij":
+        cache.put(label, get_run(label))
+    assert sum(cache.disk.values()) <= 1000
+    assert cache.get("a") is None  # Deleted once the disk budget was exceeded
+    assert cache.get("j").history.label == "j"
+    assert sorted(os.listdir(cache.path)) == sorted(f"{key}.pickle" for key in cache.disk)
+
+
+def test_images_count_towards_memory(tmp_path):
+    cache = ResultCache(memory_budget=250, path=str(tmp_path / "cache"))
+    run = get_run("a")
+    cache.put("a", run)
+    cache.put("b", get_run("b"))
+    cache.add_image("b", cache.get("b"), ("plot", 10), "x" * 100)
+    assert list(cache.disk) == ["a"]
+    assert cache.get("b").images[("plot", 10)] == "x" * 100
+
+
+def test_add_image_while_spilling(tmp_path):
+    # Images are added from several job threads while others move the same runs to disk
+    cache = ResultCache(memory_budget=300, path=str(tmp_path / "cache"))
+    errors = []
+
+    def work(thread):
+        try:
+            for n in range(50):
+                key = str(n % 5)
+                run = cache.get(key) or get_run(key)
+                cache.add_image(key, run, (thread, n), "x")
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_private_folder():
+    cache = ResultCache(memory_budget=100)
+    cache.put("a", get_run("a"))
+    cache.put("b", get_run("b"))
+    assert os.stat(cache.path).st_mode & 0o777 == 0o700
+    cache.clear()
+    os.rmdir(cache.path)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="permissions are only checked on POSIX")
+def test_shared_folder_is_refused(tmp_path):
+    path = tmp_path / "shared"
+    path.mkdir()
+    path.chmod(0o777)
+    cache = ResultCache(memory_budget=100, path=str(path))
+    cache.put("a", get_run("a"))
+    with pytest.raises(PermissionError):
+        cache.put("b", get_run("b"))
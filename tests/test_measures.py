@@ -0,0 +1,51 @@
+import pytest
+
+from covid_sim.simulator import Lockdown, SocialDistancing, Ventilators, MeasureSchedule
+
+"""
+Checks the multipliers a MeasureSchedule gives on each day, including overlapping windows of the same measure.
+"""
+
+
+def test_no_measures():
+    schedule = MeasureSchedule([])
+    assert schedule.multipliers(0) == (1.0, 1.0, 1.0)
+    assert schedule.multipliers(100) == (1.0, 1.0, 1.0)
+
+
+def test_window():
+    schedule = MeasureSchedule([Lockdown(starts=[10], ends=[20], multiplier=0.5)])
+    assert schedule.multipliers(9) == (1.0, 1.0, 1.0)
+    assert schedule.multipliers(10) == (0.5, 1.0, 1.0)
+    assert schedule.multipliers(19) == (0.5, 1.0, 1.0)
+    assert schedule.multipliers(20) == (1.0, 1.0, 1.0)
+
+
+def test_overlapping_windows():
+    # The measure is in force until every window it started has ended, and is never applied twice
+    schedule = MeasureSchedule([Lockdown(starts=[10, 15], ends=[20, 30], multiplier=0.5)])
+    assert schedule.multipliers(12) == (0.5, 1.0, 1.0)
+    assert schedule.multipliers(17) == (0.5, 1.0, 1.0)
+    assert schedule.multipliers(25) == (0.5, 1.0, 1.0)
+    assert schedule.multipliers(30) == (1.0, 1.0, 1.0)
+
+
+def test_window_starting_as_another_ends():
+    schedule = MeasureSchedule([Lockdown(starts=[10, 20], ends=[20, 30], multiplier=0.5)])
+    assert [schedule.multipliers(day)[0] for day in (19, 20, 29, 30)] == [0.5, 0.5, 0.5, 1.0]
+
+
+def test_end_without_start_is_ignored():
+    schedule = MeasureSchedule([Lockdown(starts=[10], ends=[5, 20], multiplier=0.5)])
+    assert schedule.multipliers(7) == (1.0, 1.0, 1.0)
+    assert schedule.multipliers(15) == (0.5, 1.0, 1.0)
+    assert schedule.multipliers(20) == (1.0, 1.0, 1.0)
+
+
+def test_measures_on_the_same_probability_multiply():
+    schedule = MeasureSchedule([Lockdown(starts=[10], ends=[30], multiplier=0.5),
+                                SocialDistancing(starts=[20], ends=[], multiplier=0.4),
+                                Ventilators(starts=[0], ends=[], multiplier=0.6)])
+    assert schedule.multipliers(5) == (1.0, 1.0, 0.6)
+    assert schedule.multipliers(25) == pytest.approx((0.2, 1.0, 0.6))
+    assert schedule.multipliers(35) == pytest.approx((0.4, 1.0, 0.6))
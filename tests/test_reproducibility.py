@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from covid_sim.defaults import defaults
+from covid_sim.network import ContactNetwork
+from covid_sim.simulator import Simulation, parse_parameters
+
+"""
+Checks the claims that runs are bit-identical: resuming from a checkpoint, splitting the grid engine across workers,
+packing the grid and running the grid's own network all give exactly the same trajectory as the plain grid engine.
+"""
+
+SIZE = 80  # Bigger than one 64 row block, so the tiled engine has several blocks
+DAYS = 30
+
+
+def get_simulation(size=SIZE, seed=2021, **kwargs):
+    simulation = Simulation(**{**parse_parameters({**defaults, "size": size, "duration": DAYS}), "seed": seed,
+                               **kwargs})
+    simulation.infect_randomly(20)
+    return simulation
+
+
+def run(simulation, days):
+    for day in range(days):
+        simulation.update()
+    return simulation
+
+
+ENGINES = [
+    {"engine": "grid"},
+    {"engine": "frontier"},
+    {"engine": "packed"},
+    {"engine": "network"},
+    {"engine": "grid", "workers": 1},
+]
+
+
+@pytest.mark.parametrize("kwargs", ENGINES, ids=lambda kwargs: "-".join(str(v) for v in kwargs.values()))
+@pytest.mark.parametrize("seed", [lambda: 7, lambda: np.random.SeedSequence(7).spawn(3)[2]], ids=["seed", "child seed"])
+def test_resume_from_checkpoint(tmp_path, kwargs, seed):
+    # A child seed, as spawned for workers and replicates, must be rebuilt with its spawn key (a fresh one for each
+    # run, as spawning from a SeedSequence moves it on)
+    uninterrupted = run(get_simulation(seed=seed(), **kwargs), DAYS)
+    path = str(tmp_path / "checkpoint.npz")
+    interrupted = run(get_simulation(seed=seed(), **kwargs), DAYS // 2)
+    interrupted.save_checkpoint(path)
+    interrupted.close()
+    uninterrupted.close()
+
+    resumed = Simulation.load_checkpoint(path)
+    run(resumed, DAYS - DAYS // 2)
+    resumed.close()
+    assert resumed.day == uninterrupted.day
+    assert np.array_equal(resumed.get_status_grid(), uninterrupted.get_status_grid())
+    assert np.array_equal(resumed.get_count_history(), uninterrupted.get_count_history())
+
+
+def test_resume_cell_engine(tmp_path):
+    uninterrupted = run(get_simulation(size=20, engine="cell"), 10)
+    path = str(tmp_path / "checkpoint.npz")
+    run(get_simulation(size=20, engine="cell"), 5).save_checkpoint(path)
+    resumed = run(Simulation.load_checkpoint(path), 5)
+    assert np.array_equal(resumed.get_status_grid(), uninterrupted.get_status_grid())
+
+
+def test_workers_match():
+    one = run(get_simulation(workers=1), DAYS)
+    two = run(get_simulation(workers=2), DAYS)
+    one.close()
+    two.close()
+    assert np.array_equal(one.get_status_grid(), two.get_status_grid())
+    assert np.array_equal(one.get_count_history(), two.get_count_history())
+
+
+def test_close_keeps_state():
+    # The grids are copied out of shared memory on close, so the simulation can still be read and carried on
+    simulation = run(get_simulation(workers=2), DAYS // 2)
+    simulation.close()
+    status = simulation.get_status_grid()
+    simulation.get_rgb_matrix()
+    run(simulation, DAYS - DAYS // 2)
+    uninterrupted = run(get_simulation(workers=1), DAYS)
+    uninterrupted.close()
+    assert status.shape == (SIZE, SIZE)
+    assert np.array_equal(simulation.get_status_grid(), uninterrupted.get_status_grid())
+
+
+@pytest.mark.parametrize("engine", ["packed", "network"])
+def test_engine_matches_grid(engine):
+    grid = run(get_simulation(), DAYS)
+    other = run(get_simulation(engine=engine), DAYS)
+    assert np.array_equal(other.get_status_grid(), grid.get_status_grid())
+    assert np.array_equal(other.get_count_history(), grid.get_count_history())
+
+
+def test_lattice_network_matches_grid():
+    network = ContactNetwork.lattice(SIZE, SIZE)
+    grid = run(get_simulation(), DAYS)
+    other = run(get_simulation(engine="network", network=network), DAYS)
+    assert np.array_equal(other.get_status_grid(), grid.get_status_grid())
+
+
+def test_checkpoint_every_needs_path():
+    with pytest.raises(ValueError):
+        get_simulation(checkpoint_every=5)
+
+
+def test_checkpoint_every(tmp_path):
+    path = str(tmp_path / "checkpoint.npz")
+    simulation = run(get_simulation(checkpoint_every=5, checkpoint_path=path), 12)
+    resumed = Simulation.load_checkpoint(path, checkpoint_every=None)
+    assert resumed.day == 10
+    run(resumed, 2)
+    assert np.array_equal(resumed.get_status_grid(), simulation.get_status_grid())
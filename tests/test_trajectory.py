@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from covid_sim.defaults import defaults
+from covid_sim.recorder import History
+from covid_sim.simulator import Simulation, parse_parameters
+from covid_sim.trajectory import Trajectory, pack_statuses, packed_size, unpack_statuses
+
+"""
+Checks the 3-bit packing of status grids and reading trajectories back, including ones cut short by a crash.
+"""
+
+DAYS = 12
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 5), (8, 8), (7, 13)])
+def test_pack_unpack(shape):
+    status = np.random.default_rng(1).integers(5, size=shape).astype(np.uint8)
+    packed = pack_statuses(status)
+    assert len(packed) == packed_size(shape)
+    assert np.array_equal(unpack_statuses(packed, shape), status)
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    # A simulation streamed to a trajectory folder, along with a History of the same run
+    path = str(tmp_path / "trajectory")
+    simulation = Simulation(**parse_parameters({**defaults, "size": 30, "seed": 4, "duration": DAYS}), trajectory=path)
+    simulation.infect_randomly(10)
+    history = History.record(simulation, DAYS)
+    simulation.close()
+    return path, history
+
+
+def test_read_back(recorded):
+    path, history = recorded
+    trajectory = Trajectory(path)
+    assert trajectory.days == DAYS + 1
+    for day in range(DAYS + 1):
+        assert np.array_equal(trajectory.status(day), history.status(day))
+    assert np.array_equal(trajectory.get_count_history(), history.get_count_history())
+
+
+@pytest.mark.parametrize("name", ["counts", "positions", "values", "index", "keyframes"])
+def test_partial_record(recorded, name):
+    # A crash part way through writing a record leaves the days already indexed readable
+    path, history = recorded
+    with open(os.path.join(path, f"{name}.bin"), "ab") as f:
+        f.write(b"abc")
+    trajectory = Trajectory(path)
+    assert trajectory.days == DAYS + 1
+    assert np.array_equal(trajectory.status(DAYS), history.status(DAYS))
+    assert np.array_equal(trajectory.get_count_history(), history.get_count_history())
+
+
+def test_unindexed_day(recorded):
+    # A day whose index entry was never written isn't counted, even if some of its data was
+    path, history = recorded
+    with open(os.path.join(path, "index.bin"), "r+b") as f:
+        f.truncate(DAYS * 8)
+    trajectory = Trajectory(path)
+    assert trajectory.days == DAYS
+    assert np.array_equal(trajectory.status(DAYS - 1), history.status(DAYS - 1))
+    with pytest.raises(IndexError):
+        trajectory.status(DAYS)
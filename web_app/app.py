@@ -1,39 +1,145 @@
 import base64
 import os
+import time
+from io import BytesIO
 
 import dash
 import dash_bootstrap_components as dbc
+import matplotlib.pyplot as plt
 from dash.dependencies import Output, Input, State
 from dash.exceptions import PreventUpdate
 
-from covid_sim.animation import Animation, plot_simulation, plot_ages
+from covid_sim.animation import plot_simulation, plot_ages
+from covid_sim.export import WRITERS, export_animation
+from covid_sim.recorder import History
 from covid_sim.simulator import Simulation
+from web_app.cache import CachedRun, ResultCache, parameters_key
 from web_app.functions import get_bottom_lvl_keys, unflatten_dict, parse_measures
+from web_app.jobs import JobQueue
 from web_app.layout import get_layout
 
 
-def get_app(defaults):
-    """Creates and returns a dash web app which controls the simulation"""
+def data_uri(buffer, mime):
+    """Encodes an in-memory file as a data URI, to be shown directly in an html image element"""
+    return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def animation_format(filename):
+    """
+    Format to save an animation in, from the file extension - a gif (as the web app always saved) if it isn't known
+    """
+    extension = os.path.splitext(filename)[1][1:].lower()
+    return extension if extension in WRITERS else "gif"
+
+
+def encode_figure(fig):
+    """Draws a matplotlib figure as a png data URI (without writing it to disk) and closes the figure"""
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return data_uri(buffer, "image/png")
+
+
+def encode_animation(simulation, duration, scale):
+    """Draws the animation of a simulation as a gif data URI (without writing it to disk)"""
+    buffer = BytesIO()
+    export_animation(simulation, duration, buffer, format="gif", scale=scale)
+    return data_uri(buffer, "image/gif")
+
+
+def get_app(defaults, workers=1, max_queued=8, cache=None):
+    """
+    Creates and returns a dash web app which controls the simulation. Simulations run in the background on up to
+    workers threads, with at most max_queued more waiting for a free one. cache holds keyword arguments for the
+    ResultCache of recent runs (memory_budget, disk_budget and path).
+    """
 
     app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SOLAR])
     app.title = "COVID Simulator"
     app.layout = get_layout(app=app, defaults=defaults)  # Get layout from layout.py
 
+    jobs = JobQueue(workers=workers, max_queued=max_queued)
+    cache = ResultCache(**(cache or {}))  # Recent runs and their images, so repeated inputs return straight away
+
+    def generate(job, btn, kwargs, anim_fname, plot_fname):
+        """
+        Runs the simulation and draws its outputs (in a background job). Returns the status message and the new
+        image sources (None for images which haven't changed).
+        """
+        # Run the simulation once, recording its history, unless a long enough run with these parameters is cached
+        key = parameters_key(kwargs)
+        duration = kwargs["duration"]
+        run = cache.get(key)
+        cached = run is not None and run.history.duration >= duration
+        if not cached:
+            simulation = Simulation(**kwargs, profile=True)
+            simulation.infect_randomly(kwargs["cases"])
+            history = History(simulation)
+            for day in range(duration):
+                simulation.update()
+                history.append(simulation)
+                job.day = day + 1
+            run = CachedRun(history, profile=simulation.profiler.summary())
+        job.day = job.duration
+        job.stage = "Drawing"
+
+        # Draw the outputs, adding the time taken to the simulation's profile for the user to see
+        start = time.perf_counter()
+        result = draw(key, run, btn, duration, anim_fname, plot_fname)
+        report = [run.profile, "(Simulation reused from the cache)"] if cached else [run.profile]
+        job.report = "\n".join([*report, f"Drawing took {1000 * (time.perf_counter() - start):.0f}ms"])
+        return result
+
+    def draw(key, run, btn, duration, anim_fname, plot_fname):
+        # Draws (or fetches from the cache) the images for the button pressed
+        history = run.history
+        scale = max(1, 400 // history.width)  # Draw small grids larger in the animation
+
+        # Plot age distribution
+        if ("age",) not in run.images:
+            cache.add_image(key, run, ("age",), encode_figure(plot_ages(history.replay())))
+        age_src = run.images["age",]
+
+        if btn == 'anim':  # Run animation
+            if anim_fname is None:
+                if ("anim", duration, scale) not in run.images:
+                    # Encode animation as gif
+                    cache.add_image(key, run, ("anim", duration, scale),
+                                    encode_animation(history.replay(), duration, scale))
+                # Return these into the image html elements
+                return "Finished generating animation", run.images["anim", duration, scale], None, age_src
+            else:
+                cache.put(key, run)
+                export_animation(history.replay(), duration, anim_fname, format=animation_format(anim_fname),
+                                 scale=scale)  # Save animation
+                # Notify user it has finished saving
+                return f"Finished saving animation in {anim_fname}", None, None, None
+
+        elif btn == 'plot':  # Run plot
+            if plot_fname is None:
+                if ("plot", duration) not in run.images:
+                    # Encode simulation plot
+                    cache.add_image(key, run, ("plot", duration),
+                                    encode_figure(plot_simulation(history.replay(), duration)))
+                # Return these into the image html elements
+                return "Finished generating plot", None, run.images["plot", duration], age_src
+            else:
+                cache.put(key, run)
+                fig_simulation = plot_simulation(history.replay(), duration)
+                fig_simulation.savefig(plot_fname)  # Save simulation plot
+                plt.close(fig_simulation)
+                # Notify user it has finished saving
+                return f"Finished saving plot in {plot_fname}", None, None, None
+
     @app.callback(
-        [Output('lbl-status', 'children'),  # Output to status label to know when plot/animation generation has finished
-         # Image outputs
-         Output('img-animation', 'src'),
-         Output('img-plot', 'src'),
-         Output('img-age', 'src')],
+        # Output the submitted job's ID, and start polling its progress
+        [Output('store-job', 'data'),
+         Output('int-job', 'disabled')],
         # Button inputs
         [Input('btn-anim', 'n_clicks'),
          Input('btn-plot', 'n_clicks')],
-        # Retain images when callback fired
-        [State('img-animation', 'src'),
-         State('img-plot', 'src'),
-         State('img-age', 'src'),
-         # File name inputs
-         State('txt-anim-fname', 'value'),
+        # File name inputs
+        [State('txt-anim-fname', 'value'),
          State('txt-plot-fname', 'value'),
          # Basic parameter inputs
          State('num-size', 'value'),
@@ -52,7 +158,7 @@ def get_app(defaults):
            values.keys()],
          ]
     )
-    def run(btn_anim, btn_plot, anim_src, plot_src, age_src, anim_fname, plot_fname, *args):
+    def run(btn_anim, btn_plot, anim_fname, plot_fname, *args):
         ctx = dash.callback_context
 
         # Don't continue if no button pressed
@@ -68,48 +174,46 @@ def get_app(defaults):
 
         kwargs = parse_measures(kwargs)  # Format parameters dictionary into proper form
 
-        # Set up the simulation
-        simulation = Simulation(**kwargs)
-        simulation.infect_randomly(kwargs["cases"])
-
-        if not os.path.exists("web_app/assets"):
-            os.mkdir("web_app/assets")  # Set up assets folder
-
-        # Plot age distribution
-        fig_age = plot_ages(simulation)
-        fig_age.savefig("web_app/assets/age.png")
-
-        if btn == 'anim':  # Run animation
-            animation = Animation(simulation, duration=kwargs["duration"])
+        # Submit the simulation to run in the background, returning straight away
+        job_id = jobs.submit(generate, kwargs["duration"], btn, kwargs, anim_fname, plot_fname)
+        return job_id, False
 
-            if anim_fname is None:
-                animation.save("web_app/assets/anim.gif")  # Save animation as gif
-                # Encode animation and age distribution plot
-                encoded_anim = base64.b64encode(open("web_app/assets/anim.gif", "rb").read())
-                encoded_age = base64.b64encode(open("web_app/assets/age.png", "rb").read())
-                # Return these into the image html elements
-                return "Finished generating animation", f"data:image/png;base64,{encoded_anim.decode()}", plot_src, \
-                       f"data:image/png;base64,{encoded_age.decode()}"
-            else:
-                animation.save(anim_fname)  # Save animation
-                # Notify user it has finished saving
-                return f"Finished saving animation in {anim_fname}", anim_src, plot_src, age_src
-
-        elif btn == 'plot':  # Run plot
-            fig_simulation = plot_simulation(simulation, 100)
-
-            if plot_fname is None:
-                fig_simulation.savefig("web_app/assets/plot.png")
-                # Encode simulation plot and age distribution plot
-                encoded_plot = base64.b64encode(open("web_app/assets/plot.png", "rb").read())
-                encoded_age = base64.b64encode(open("web_app/assets/age.png", "rb").read())
-                # Return these into the image html elements
-                return "Finished generating plot", anim_src, f"data:image/png;base64,{encoded_plot.decode()}", \
-                       f"data:image/png;base64,{encoded_age.decode()}"
-            else:
-                fig.savefig(plot_fname)  # Save simulation plot
-                # Notify user it has finished saving
-                return f"Finished saving plot in {plot_fname}", anim_src, plot_src, age_src
+    @app.callback(
+        [Output('lbl-status', 'children'),  # Output to status label to show progress and when generation has finished
+         # Image outputs
+         Output('img-animation', 'src'),
+         Output('img-plot', 'src'),
+         Output('img-age', 'src'),
+         # Stop polling once the job is done
+         Output('int-job', 'disabled'),
+         # Profile of the last job
+         Output('pre-profile', 'children')],
+        [Input('int-job', 'n_intervals')],
+        # Retain images which haven't changed
+        [State('store-job', 'data'),
+         State('img-animation', 'src'),
+         State('img-plot', 'src'),
+         State('img-age', 'src')]
+    )
+    def poll(n_intervals, job_id, anim_src, plot_src, age_src):
+        job = jobs.get(job_id)
+        if job is None:
+            raise PreventUpdate()
+        if job.status == "queued":
+            return f"Waiting to run (position {jobs.position(job_id)} in queue)", anim_src, plot_src, age_src, False, \
+                   dash.no_update
+        if job.status == "running":
+            if job.stage == "Simulating":
+                return f"Simulating day {job.day} of {job.duration} ({job.progress}%)", anim_src, plot_src, age_src, \
+                       False, dash.no_update
+            return f"{job.stage}...", anim_src, plot_src, age_src, False, dash.no_update
+        if job.status == "finished":
+            status, *sources = job.result
+            anim_src, plot_src, age_src = [new or old for new, old in zip(sources, [anim_src, plot_src, age_src])]
+            return status, anim_src, plot_src, age_src, True, job.report
+        if job.status == "rejected":
+            return job.error, anim_src, plot_src, age_src, True, dash.no_update
+        return f"Failed: {job.error}", anim_src, plot_src, age_src, True, dash.no_update
 
     @app.callback(
         Output("clp-probabilities", "is_open"),
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import pickle
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+
+"""
+Cache.py keeps the results of recent simulations run from the web app, so pressing a button again with the same inputs
+doesn't run the simulation again. Runs are keyed on a hash of the simulation parameters (and seed) and hold the
+recorded history along with any images already drawn from it. The least recently used runs are moved to disk once
+the memory budget is exceeded, and deleted once the disk budget is exceeded too.
+"""
+
+# Parameters which only change how a run is drawn rather than the run itself (a longer run also serves shorter ones)
+PLOTTING_PARAMETERS = ("duration",)
+
+
+def parameters_key(kwargs):
+    """Canonical hash of the simulation parameters, so the same inputs always give the same key"""
+    parameters = {k: v for k, v in kwargs.items() if k not in PLOTTING_PARAMETERS}
+    text = json.dumps(parameters, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class CachedRun:
+    """
+    The CachedRun class holds one recorded simulation, its profile and the images drawn from it so far, each image
+    stored under a key describing what was drawn (e.g. ("plot", duration)).
+    """
+
+    def __init__(self, history, profile=None):
+        self.history = history
+        self.profile = profile  # Summary of the time taken by each phase of the simulation
+        self.images = {}
+
+    @property
+    def nbytes(self):
+        return self.history.nbytes + sum(len(image) for image in self.images.values())
+
+
+def check_private(path):
+    """
+    Raises PermissionError unless path is a folder owned by this user which nobody else can access. Runs are pickled to
+    the cache folder and loaded back, so anyone able to replace the files could run their own code in the web server.
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"The cache folder {path} is not a folder")
+    if os.name == "posix" and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise PermissionError(f"The cache folder {path} must be owned by this user with permissions 0700")
+
+
+class ResultCache:
+    """
+    The ResultCache class is a least recently used cache of CachedRuns. Up to memory_budget bytes of runs are kept in
+    memory; beyond that the oldest are pickled to path, which holds up to disk_budget bytes. Without a path, a new
+    private temporary folder is made the first time a run is moved to disk.
+    """
+
+    def __init__(self, memory_budget=256 * 2 ** 20, disk_budget=2 ** 30, path=None):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.path = path
+        self.memory = OrderedDict()  # Key -> CachedRun, least recently used first
+        self.disk = OrderedDict()  # Key -> size of the file on disk, least recently used first
+        self.lock = threading.Lock()  # Runs are stored from the web app's worker threads
+
+    def directory(self):
+        # The folder runs are moved to, made (private to this user) if needed
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix="covid_sim_cache_")
+        else:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            check_private(self.path)
+        return self.path
+
+    def filename(self, key):
+        return os.path.join(self.path, f"{key}.pickle")
+
+    def get(self, key):
+        """Returns the cached run with the given key (loading it back from disk if needed), or None"""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            if key in self.disk:
+                del self.disk[key]
+                try:
+                    with open(self.filename(key), "rb") as f:
+                        run = pickle.load(f)
+                    os.remove(self.filename(key))
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    return None  # The file has gone or is broken; treat as not cached
+                self.memory[key] = run
+                self.evict()
+                return run
+            return None
+
+    def put(self, key, run):
+        """Stores a run (or updates the size of one already stored)"""
+        with self.lock:
+            self.store(key, run)
+
+    def add_image(self, key, run, name, image):
+        """
+        Adds an image to a run and stores the run. The image is added under the lock, so another job thread can't be
+        pickling the same run to disk at the time.
+        """
+        with self.lock:
+            run.images[name] = image
+            self.store(key, run)
+
+    def store(self, key, run):
+        # Keeps a run in memory as the most recently used, dropping any older copy of it on disk (called with the lock)
+        if key in self.disk:
+            del self.disk[key]
+            try:
+                os.remove(self.filename(key))
+            except OSError:
+                pass
+        self.memory[key] = run
+        self.memory.move_to_end(key)
+        self.evict()
+
+    def evict(self):
+        # Moves the least recently used runs to disk until the rest fit in memory (always keeping the newest)
+        while len(self.memory) > 1 and sum(run.nbytes for run in self.memory.values()) > self.memory_budget:
+            key, run = self.memory.popitem(last=False)
+            self.spill(key, run)
+        while self.disk and sum(self.disk.values()) > self.disk_budget:
+            key, _ = self.disk.popitem(last=False)
+            try:
+                os.remove(self.filename(key))
+            except OSError:
+                pass
+
+    def spill(self, key, run):
+        # Writes a run to disk (if it fits in the disk budget at all)
+        if run.nbytes > self.disk_budget:
+            return
+        self.directory()
+        temporary = f"{self.filename(key)}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(run, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.filename(key))
+        self.disk[key] = os.path.getsize(self.filename(key))
+
+    def clear(self):
+        with self.lock:
+            for key in self.disk:
+                try:
+                    os.remove(self.filename(key))
+                except OSError:
+                    pass
+            self.memory.clear()
+            self.disk.clear()
@@ -0,0 +1,100 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Jobs.py runs the web app's simulations in the background, so a long simulation doesn't hold up the web server.
+Each button press submits a job to a JobQueue and gets a job ID straight away, which the page then polls for the
+job's progress (the current day of the simulation) and, once finished, its results.
+"""
+
+
+class Job:
+    """
+    The Job class holds the state of one submitted job: its status (queued, running, finished, failed or rejected),
+    its progress through the simulation and, once finished, its result or error.
+    """
+
+    def __init__(self, job_id, duration):
+        self.id = job_id
+        self.status = "queued"
+        self.stage = "Simulating"  # What the job is doing while running, shown to the user
+        self.day = 0
+        self.duration = duration
+        self.result = None
+        self.error = None
+        self.report = None  # Anything else to show the user once finished, e.g. a profile of the job
+
+    @property
+    def progress(self):
+        # Percentage of the simulation's days run so far
+        return 100 * self.day // self.duration if self.duration else 100
+
+    @property
+    def done(self):
+        return self.status in ("finished", "failed", "rejected")
+
+
+class JobQueue:
+    """
+    The JobQueue class runs jobs on a pool of worker threads. At most workers jobs run at once and at most max_queued
+    wait for a free worker; jobs submitted beyond that are rejected rather than left waiting indefinitely.
+    Finished jobs are kept (up to max_kept of them) so their results can be collected.
+    """
+
+    def __init__(self, workers=1, max_queued=8, max_kept=32):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_kept = max_kept
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="simulation")
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, function, duration, *args):
+        """
+        Submits function(job, *args) to be run in the background and returns the job's ID. The function can report
+        its progress by setting job.day (out of duration) and job.stage, and its return value becomes job.result.
+        """
+        with self.lock:
+            job = Job(str(next(self.ids)), duration)
+            self.jobs[job.id] = job
+            self.forget_finished()
+            if self.queued() > self.max_queued:
+                job.status = "rejected"
+                job.error = f"Too many simulations waiting (at most {self.max_queued}), please try again later"
+                return job.id
+        self.executor.submit(self.run, job, function, *args)
+        return job.id
+
+    def run(self, job, function, *args):
+        # Runs a job in a worker thread, recording its result or error
+        job.status = "running"
+        try:
+            job.result = function(job, *args)
+            job.status = "finished"
+        except Exception as error:
+            job.error = f"{type(error).__name__}: {error}"
+            job.status = "failed"
+
+    def get(self, job_id):
+        """Returns the job with the given ID, or None if there isn't one (or it has been forgotten)"""
+        return self.jobs.get(job_id)
+
+    def queued(self):
+        # Number of jobs waiting for a free worker
+        return sum(job.status == "queued" for job in self.jobs.values())
+
+    def position(self, job_id):
+        """Position of a queued job in the queue (1 is next to run)"""
+        queued = [job.id for job in self.jobs.values() if job.status == "queued"]
+        return queued.index(job_id) + 1 if job_id in queued else 0
+
+    def forget_finished(self):
+        # Drops the oldest finished jobs beyond max_kept (dictionaries keep the order jobs were submitted in)
+        finished = [job.id for job in self.jobs.values() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_kept)]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
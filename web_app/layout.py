@@ -153,7 +153,14 @@ def get_layout(app, defaults):
                 dbc.Col([
                     dbc.Label(id='lbl-status')
                 ])
-            ])
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.Pre(id='pre-profile')  # Time taken by each phase of the last simulation
+                ])
+            ]),
+            dcc.Store(id="store-job"),  # ID of the job running the last simulation
+            dcc.Interval(interval=500, disabled=True, id="int-job"),  # Polls the job's progress while it runs
         ]),
         html.Br(),
         dbc.Container([